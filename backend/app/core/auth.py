@@ -1,4 +1,7 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import hashlib
+import time
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -9,6 +12,8 @@ from pydantic import BaseModel
 SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key-for-aura-vibe-change-in-prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 24 hours
+# Verified tokens kept in memory; 0 verifies every request
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
 
 security = HTTPBearer()
 
@@ -27,7 +32,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> TokenData:
+def _decode_token(token: str) -> tuple[TokenData, float]:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -43,7 +48,54 @@ def verify_token(token: str) -> TokenData:
         token_data = TokenData(user_id=user_id, session_code=session_code, role=role)
     except JWTError:
         raise credentials_exception
-    return token_data
+    exp = payload.get("exp")
+    return token_data, float(exp) if exp is not None else float("inf")
+
+def verify_token(token: str) -> TokenData:
+    return _decode_token(token)[0]
+
+class TokenCache:
+    """Bounded LRU of verified tokens.
+
+    Entries are keyed by the SHA-256 of the token, so raw tokens are not
+    kept in memory, and hold the decoded claims until the token's `exp`.
+    An expired entry is dropped and the token verified again, which then
+    fails. Tokens that fail verification are never cached.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: OrderedDict[bytes, tuple[float, TokenData]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str) -> TokenData:
+        if self.max_entries <= 0:
+            return verify_token(token)
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            exp, token_data = entry
+            if self.clock() < exp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return token_data
+            del self._entries[key]
+        self.misses += 1
+        token_data, exp = _decode_token(token)
+        self._entries[key] = (exp, token_data)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return token_data
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+token_cache = TokenCache()
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenData:
-    return verify_token(credentials.credentials)
+    return token_cache.verify(credentials.credentials)
@@ -0,0 +1,542 @@
+"""Cross-process relay for WebSocket session events.
+
+Each API worker only holds its own sockets, so anything that must reach
+every guest of a session (broadcasts, participant counts, playback state,
+queue sequence numbers) goes through a backplane:
+
+- ``memory``: single process, nothing leaves the worker (the default).
+- ``unix:///path/to/aura.sock``: workers on one host share a small hub
+  over a Unix socket. The first worker to take the lock file serves it.
+- ``redis://host:port``: any server speaking the Redis protocol.
+
+The hub in this module speaks the same subset of the Redis protocol, so
+it doubles as a local stand-in for Redis (``python -m app.core.backplane``).
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "memory")
+# Longest wait for a reply from the backplane server before falling back
+# to this worker's state
+WS_BACKPLANE_TIMEOUT_S = float(os.getenv("WS_BACKPLANE_TIMEOUT_S", "1"))
+
+EVENTS_CHANNEL = "aura:events"
+SEQUENCE_KEY = "aura:seq:{}"
+PARTICIPANTS_KEY = "aura:participants"
+PLAYBACK_KEY = "aura:playback"
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+# Drops every cached view of shared state, after events may have been missed
+Resync = Callable[[], None]
+
+CONNECTION_ERRORS = (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError)
+
+
+class InProcessBackplane:
+    """Keeps shared session state in this process; events are never relayed."""
+
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        # Sequence numbers restart with the process; versions derived from
+        # them are qualified by this epoch
+        self.epoch = self.worker_id
+        self.sequences: dict[str, int] = {}
+        self.participants: dict[str, int] = {}
+        self.playback_states: dict[str, dict] = {}
+
+    async def start(self, deliver: Deliver, resync: Resync | None = None):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, session_code: str, message: dict):
+        pass
+
+    async def next_sequence(self, session_code: str) -> int:
+        self.sequences[session_code] = self.sequences.get(session_code, 0) + 1
+        return self.sequences[session_code]
+
+    async def current_sequence(self, session_code: str) -> int:
+        return self.sequences.get(session_code, 0)
+
+    async def add_participants(self, session_code: str, delta: int) -> int:
+        count = max(self.participants.get(session_code, 0) + delta, 0)
+        if count:
+            self.participants[session_code] = count
+        else:
+            self.participants.pop(session_code, None)
+        return count
+
+    async def set_playback_state(self, session_code: str, state: dict):
+        self.playback_states[session_code] = state
+
+    async def get_playback_state(self, session_code: str) -> dict | None:
+        return self.playback_states.get(session_code)
+
+
+# --- Redis protocol (RESP) ---------------------------------------------------
+
+class RespError(Exception):
+    pass
+
+
+class SimpleString(str):
+    pass
+
+
+def encode_command(*args) -> bytes:
+    out = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def encode_reply(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, SimpleString):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, bool) or isinstance(value, int):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readuntil(b"\r\n")
+    kind, body = line[:1], line[1:-2].decode("utf-8")
+    if kind == b"+":
+        return SimpleString(body)
+    if kind == b"-":
+        raise RespError(body)
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unexpected reply type {kind!r}")
+
+
+class RespBackplane(InProcessBackplane, ABC):
+    """Backplane over any Redis-protocol server.
+
+    Uses one connection for commands and a second one subscribed to the
+    events channel. Events published by this worker are delivered locally
+    by the caller and skipped when they come back from the server.
+
+    While the server is unreachable or slower than `command_timeout`,
+    shared state degrades to this worker's own copy (as with
+    `InProcessBackplane`): the error is logged and the request carries on.
+    Sequence numbers continue from the last shared value this worker saw.
+
+    Events can be lost meanwhile, so caches are resynced: `resync` runs
+    each time the subscription is (re)established and whenever a publish
+    fails, and the next successful publish first tells the other workers
+    to resync too.
+    """
+
+    distributed = True
+    reconnect_delay = 0.5
+
+    def __init__(self, command_timeout: float = WS_BACKPLANE_TIMEOUT_S):
+        super().__init__()
+        # Sequence numbers live on the server and are shared by all workers
+        self.epoch = "shared"
+        self.command_timeout = command_timeout
+        self._deliver: Deliver | None = None
+        self._resync: Resync | None = None
+        self._unpublished = False
+        self._commands: tuple[asyncio.StreamReader, asyncio.StreamWriter] | None = None
+        self._command_lock = asyncio.Lock()
+        self._listener: asyncio.Task | None = None
+        self._subscribed = asyncio.Event()
+
+    @abstractmethod
+    async def _open_connection(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        ...
+
+    async def _handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pass
+
+    async def _connect(self):
+        reader, writer = await self._open_connection()
+        await self._handshake(reader, writer)
+        return reader, writer
+
+    async def start(self, deliver: Deliver, resync: Resync | None = None):
+        self._deliver = deliver
+        self._resync = resync
+        self._commands = await self._connect()
+        self._listener = asyncio.create_task(self._listen())
+        await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        self._drop_commands()
+
+    async def execute(self, *args):
+        """Run one command; raises TimeoutError (an OSError) if the server does not answer in time."""
+        return await asyncio.wait_for(self._execute(*args), self.command_timeout)
+
+    async def _execute(self, *args):
+        async with self._command_lock:
+            for attempt in range(2):
+                try:
+                    if self._commands is None:
+                        self._commands = await self._connect()
+                    reader, writer = self._commands
+                    writer.write(encode_command(*args))
+                    await writer.drain()
+                    return await read_reply(reader)
+                except CONNECTION_ERRORS:
+                    self._drop_commands()
+                    if attempt:
+                        raise
+                except asyncio.CancelledError:
+                    # Timed out: a late reply would be read as the answer to the next command
+                    self._drop_commands()
+                    raise
+
+    def _drop_commands(self):
+        if self._commands is not None:
+            self._commands[1].close()
+            self._commands = None
+
+    def _resync_caches(self):
+        if self._resync is not None:
+            self._resync()
+
+    async def _listen(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                writer.write(encode_command("SUBSCRIBE", EVENTS_CHANNEL))
+                await writer.drain()
+                await read_reply(reader)
+                self._subscribed.set()
+                # Anything published while we were not subscribed is gone
+                self._resync_caches()
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        await self._dispatch(reply[2])
+            except asyncio.CancelledError:
+                if writer is not None:
+                    writer.close()
+                raise
+            except (*CONNECTION_ERRORS, RespError) as e:
+                logger.warning(f"Backplane subscription lost, reconnecting: {e}")
+                if writer is not None:
+                    writer.close()
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _dispatch(self, data: str):
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            return
+        if event.get("origin") == self.worker_id or self._deliver is None:
+            return
+        if event.get("resync"):
+            self._resync_caches()
+            return
+        try:
+            await self._deliver(event["session_code"], event["message"])
+        except Exception as e:
+            logger.error(f"Error delivering backplane event: {e}")
+
+    async def publish(self, session_code: str, message: dict):
+        event = json.dumps({"origin": self.worker_id, "session_code": session_code, "message": message})
+        try:
+            if self._unpublished:
+                await self.execute("PUBLISH", EVENTS_CHANNEL, json.dumps({"origin": self.worker_id, "resync": True}))
+                self._unpublished = False
+            await self.execute("PUBLISH", EVENTS_CHANNEL, event)
+        except Exception as e:
+            logger.error(f"Failed to publish to backplane: {e}")
+            # Other workers missed this change, and we may have missed theirs
+            self._unpublished = True
+            self._resync_caches()
+
+    def _degraded(self, command: str, error: Exception):
+        logger.warning(f"Backplane {command} failed ({error!r}), using this worker's state")
+
+    def _seen_sequence(self, session_code: str, seq: int) -> int:
+        self.sequences[session_code] = max(self.sequences.get(session_code, 0), seq)
+        return seq
+
+    async def next_sequence(self, session_code: str) -> int:
+        try:
+            seq = await self.execute("INCR", SEQUENCE_KEY.format(session_code))
+        except (*CONNECTION_ERRORS, RespError) as e:
+            self._degraded("INCR", e)
+            return await super().next_sequence(session_code)
+        return self._seen_sequence(session_code, seq)
+
+    async def current_sequence(self, session_code: str) -> int:
+        try:
+            seq = int(await self.execute("GET", SEQUENCE_KEY.format(session_code)) or 0)
+        except (*CONNECTION_ERRORS, RespError) as e:
+            self._degraded("GET", e)
+            return await super().current_sequence(session_code)
+        return self._seen_sequence(session_code, seq)
+
+    async def add_participants(self, session_code: str, delta: int) -> int:
+        try:
+            return max(await self.execute("HINCRBY", PARTICIPANTS_KEY, session_code, delta), 0)
+        except (*CONNECTION_ERRORS, RespError) as e:
+            self._degraded("HINCRBY", e)
+            return await super().add_participants(session_code, delta)
+
+    async def set_playback_state(self, session_code: str, state: dict):
+        # Kept locally too, for late joiners while the server is unreachable
+        await super().set_playback_state(session_code, state)
+        try:
+            await self.execute("HSET", PLAYBACK_KEY, session_code, json.dumps(state))
+        except (*CONNECTION_ERRORS, RespError) as e:
+            self._degraded("HSET", e)
+
+    async def get_playback_state(self, session_code: str) -> dict | None:
+        try:
+            state = await self.execute("HGET", PLAYBACK_KEY, session_code)
+        except (*CONNECTION_ERRORS, RespError) as e:
+            self._degraded("HGET", e)
+            return await super().get_playback_state(session_code)
+        return json.loads(state) if state else None
+
+
+class RedisBackplane(RespBackplane):
+    def __init__(self, url: str, command_timeout: float = WS_BACKPLANE_TIMEOUT_S):
+        super().__init__(command_timeout)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+
+    async def _open_connection(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _handshake(self, reader, writer):
+        commands = []
+        if self.password:
+            commands.append(("AUTH", self.password))
+        if self.db:
+            commands.append(("SELECT", self.db))
+        for command in commands:
+            writer.write(encode_command(*command))
+            await writer.drain()
+            await read_reply(reader)
+
+
+class UnixSocketBackplane(RespBackplane):
+    """Backplane for workers on one host, relayed through a hub on a Unix socket.
+
+    Every worker races for an exclusive lock next to the socket path; the
+    winner serves the hub for as long as it lives.
+    """
+
+    def __init__(self, path: str, serve_hub: bool = True):
+        super().__init__()
+        self.path = path
+        self.serve_hub = serve_hub
+        self.hub: BackplaneHub | None = None
+        self._lock_file = None
+
+    async def start(self, deliver: Deliver, resync: Resync | None = None):
+        if self.serve_hub:
+            await self._try_serve_hub()
+        await super().start(deliver, resync)
+
+    async def stop(self):
+        await super().stop()
+        if self.hub is not None:
+            await self.hub.stop()
+            self.hub = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _try_serve_hub(self):
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return
+        self._lock_file = lock_file
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.hub = BackplaneHub()
+        await self.hub.start_unix(self.path)
+        logger.info(f"Serving WebSocket backplane hub on {self.path}")
+
+    async def _open_connection(self):
+        for _ in range(50):
+            try:
+                return await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The hub owner may still be starting up
+                await asyncio.sleep(0.1)
+        return await asyncio.open_unix_connection(self.path)
+
+
+def create_backplane(url: str = WS_BACKPLANE) -> InProcessBackplane:
+    if not url or url == "memory":
+        return InProcessBackplane()
+    if url.startswith("unix://"):
+        return UnixSocketBackplane(url[len("unix://"):])
+    if url.startswith("redis://"):
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported WS_BACKPLANE: {url}")
+
+
+# --- Hub ---------------------------------------------------------------------
+
+class BackplaneHub:
+    """In-memory server for the subset of the Redis protocol the backplane uses."""
+
+    def __init__(self):
+        self.strings: dict[str, str] = {}
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.subscribers: dict[str, set[asyncio.StreamWriter]] = {}
+        self.server: asyncio.AbstractServer | None = None
+
+    async def start_unix(self, path: str):
+        self.server = await asyncio.start_unix_server(self._handle, path=path)
+        return self.server
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for writers in self.subscribers.values():
+                for writer in writers:
+                    writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    command = await read_reply(reader)
+                except RespError as e:
+                    writer.write(encode_reply(e))
+                    continue
+                if not isinstance(command, list) or not command:
+                    continue
+                name, args = command[0].upper(), command[1:]
+                try:
+                    reply = await self._execute(name, args, writer)
+                except (ValueError, IndexError) as e:
+                    reply = RespError(f"ERR {e}")
+                writer.write(encode_reply(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    async def _execute(self, name: str, args: list[str], writer: asyncio.StreamWriter):
+        if name == "PING":
+            return SimpleString("PONG")
+        if name in ("AUTH", "SELECT"):
+            return SimpleString("OK")
+        if name == "GET":
+            return self.strings.get(args[0])
+        if name == "INCR":
+            value = int(self.strings.get(args[0], 0)) + 1
+            self.strings[args[0]] = str(value)
+            return value
+        if name == "DEL":
+            removed = 0
+            for key in args:
+                removed += (self.strings.pop(key, None) is not None) + (self.hashes.pop(key, None) is not None)
+            return removed
+        if name == "HSET":
+            fields = self.hashes.setdefault(args[0], {})
+            added = 0
+            for field, value in zip(args[1::2], args[2::2]):
+                added += field not in fields
+                fields[field] = value
+            return added
+        if name == "HGET":
+            return self.hashes.get(args[0], {}).get(args[1])
+        if name == "HDEL":
+            fields = self.hashes.get(args[0], {})
+            return sum(fields.pop(field, None) is not None for field in args[1:])
+        if name == "HGETALL":
+            return [item for pair in self.hashes.get(args[0], {}).items() for item in pair]
+        if name == "HINCRBY":
+            fields = self.hashes.setdefault(args[0], {})
+            value = int(fields.get(args[1], 0)) + int(args[2])
+            fields[args[1]] = str(value)
+            return value
+        if name == "PUBLISH":
+            frame = encode_reply(["message", args[0], args[1]])
+            writers = self.subscribers.get(args[0], set())
+            for subscriber in list(writers):
+                subscriber.write(frame)
+            return len(writers)
+        if name == "SUBSCRIBE":
+            for channel in args:
+                self.subscribers.setdefault(channel, set()).add(writer)
+            return ["subscribe", args[-1], len(args)]
+        return RespError(f"ERR unknown command '{name}'")
+
+
+async def _serve(args):
+    hub = BackplaneHub()
+    if args.unix:
+        await hub.start_unix(args.unix)
+        print(f"Backplane hub listening on {args.unix}")
+    else:
+        await hub.start_tcp(args.host, args.port)
+        print(f"Backplane hub listening on {args.host}:{args.port}")
+    await hub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a standalone backplane hub (Redis protocol subset).")
+    parser.add_argument("--unix", help="Unix socket path to listen on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    asyncio.run(_serve(parser.parse_args()))
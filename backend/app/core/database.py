@@ -1,21 +1,113 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./aura_vibe.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./aura_vibe.db")
+
+# Connection pool, per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite connect-time pragmas. WAL lets readers run while a vote is being
+# written, and NORMAL sync is durable across application crashes in WAL mode.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Async drivers for each supported backend. Votes and migrations rely on
+# RETURNING and ON CONFLICT, so other databases are refused at startup.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    if "+" in parsed.drivername:
+        return url
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)).render_as_string(hide_password=False)
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def pool_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def sqlite_pool_options() -> dict:
+    # Local files: connections never go stale, so no recycling or pre-ping
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+
+def create_engines(url: str = SQLALCHEMY_DATABASE_URL):
+    """Build the sync and async engines for `url` with tuned connections."""
+    backend = make_url(url).get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Unsupported database {backend!r} in DATABASE_URL; use SQLite or PostgreSQL")
+    if is_sqlite(url):
+        sync_engine = create_engine(
+            url, connect_args={"check_same_thread": False}, poolclass=QueuePool, **sqlite_pool_options()
+        )
+        # aiosqlite's default is no pooling; keep connections (and their pragmas) warm
+        async_engine = create_async_engine(to_async_url(url), poolclass=AsyncAdaptedQueuePool, **sqlite_pool_options())
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    else:
+        sync_engine = create_engine(url, **pool_options())
+        async_engine = create_async_engine(to_async_url(url), **pool_options())
+    return sync_engine, async_engine
+
+async def describe_engine(engine: AsyncEngine) -> dict:
+    """Effective settings of the engine serving requests, read back from a live connection."""
+    pool = engine.sync_engine.pool
+    report = {
+        "url": engine.url.render_as_string(hide_password=True),
+        "pool": type(pool).__name__,
+    }
+    for option in ("size", "_max_overflow", "_timeout", "_recycle"):
+        if hasattr(pool, option):
+            value = getattr(pool, option)
+            report[f"pool_{option.lstrip('_')}"] = value() if callable(value) else value
+    if engine.dialect.name == "sqlite":
+        async with engine.connect() as connection:
+            for pragma in ("journal_mode", "synchronous", "busy_timeout", "mmap_size"):
+                report[pragma] = (await connection.exec_driver_sql(f"PRAGMA {pragma}")).scalar()
+    return report
+
+# Synchronous engine, used for schema creation and offline scripts; the async
+# engine is used by the request handlers, so queries do not block the event loop.
+engine, async_engine = create_engines()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
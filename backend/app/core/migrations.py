@@ -0,0 +1,118 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in order, and is recorded in the
+`schema_version` table. Migrations are frozen: they describe the schema
+as it was when they were written rather than importing the current
+models, so an old database is always upgraded through the same steps.
+
+    python -m app.core.migrations            # upgrade to the latest version
+    python -m app.core.migrations --target 1
+"""
+import argparse
+from datetime import datetime, timezone
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+
+version_table = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _baseline(connection: Connection):
+    # Schema as created by `Base.metadata.create_all` before migrations existed;
+    # `checkfirst` leaves the tables of such databases untouched.
+    metadata = MetaData()
+    Table(
+        "sessions", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("session_code", String, unique=True, index=True),
+        Column("host_id", String),
+        Column("name", String, nullable=True),
+        Column("duration", String, nullable=True),
+        Column("manual_sort", Boolean, default=False, nullable=False),
+    )
+    Table(
+        "queue", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("song_id", String, nullable=False),
+        Column("session_code", String, ForeignKey("sessions.session_code"), nullable=False),
+        Column("song_title", String, nullable=False),
+        Column("artist_name", String, nullable=True),
+        Column("song_url", String, nullable=False),
+        Column("image", String, nullable=False),
+        Column("added_by", String, nullable=False),
+        Column("votes", Integer, default=0, nullable=False),
+        Column("played", Boolean, default=False, nullable=False),
+        Column("position", Integer, default=0, nullable=False),
+    )
+    Table(
+        "user_votes", metadata,
+        Column("user_id", String, primary_key=True, index=True),
+        Column("queue_id", Integer, ForeignKey("queue.id"), primary_key=True),
+        Column("vote_type", Boolean, nullable=False),
+    )
+    metadata.create_all(connection)
+
+
+def _queue_hot_path_indexes(connection: Connection):
+    # Unplayed queue of a session, in smart-sort and manual-sort order
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_queue_session_votes ON queue (session_code, played, votes DESC, id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_queue_session_position ON queue (session_code, played, position, id)"
+    )
+    # A participant's votes, answered from the index alone
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_user_votes_user_queue_type ON user_votes (user_id, queue_id, vote_type)"
+    )
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "queue hot path indexes", _queue_hot_path_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection: Connection) -> int:
+    version_table.create(connection, checkfirst=True)
+    return connection.execute(select(version_table.c.version).order_by(version_table.c.version.desc())).scalar() or 0
+
+
+def migrate(connection: Connection, target: int = LATEST_VERSION) -> list[int]:
+    """Apply pending migrations up to `target`; returns the versions applied.
+
+    Every step is idempotent and its version row is inserted with ON
+    CONFLICT DO NOTHING, so workers starting at the same time can all run
+    this safely.
+    """
+    applied = []
+    version = current_version(connection)
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    for number, description, step in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        step(connection)
+        connection.execute(insert(version_table).values(
+            version=number, description=description, applied_at=datetime.now(timezone.utc)
+        ).on_conflict_do_nothing())
+        applied.append(number)
+    return applied
+
+
+if __name__ == "__main__":
+    from app.core.database import engine
+
+    parser = argparse.ArgumentParser(description="Upgrade the Aura Vibe database schema")
+    parser.add_argument("--target", type=int, default=LATEST_VERSION)
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        applied = migrate(connection, args.target)
+        print(f"Applied {applied or 'nothing'}; schema is at version {current_version(connection)}")
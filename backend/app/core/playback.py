@@ -0,0 +1,54 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+PLAYBACK_SYNC_INTERVAL_MS = int(os.getenv("PLAYBACK_SYNC_INTERVAL_MS", "1000"))
+
+# Discrete player events that guests must see right away
+IMMEDIATE_PLAYBACK_ACTIONS = {"play", "pause", "seek"}
+
+
+class PlaybackSyncScheduler:
+    """Coalesces host `playback_sync` traffic per session.
+
+    Discrete events are broadcast immediately. Periodic updates such as
+    `progress` only replace the session's pending state, which is broadcast
+    once per tick, so guest traffic no longer follows the host's update rate.
+    """
+
+    def __init__(self, broadcast: Callable[[str, dict], Awaitable[None]], interval_ms: int = PLAYBACK_SYNC_INTERVAL_MS):
+        self.broadcast = broadcast
+        self.interval = interval_ms / 1000
+        self.pending: dict[str, dict] = {}
+        self.timers: dict[str, asyncio.Task] = {}
+        self.received = 0
+        self.sent = 0
+
+    async def submit(self, session_code: str, message: dict):
+        self.received += 1
+        if message.get("action") in IMMEDIATE_PLAYBACK_ACTIONS or self.interval <= 0:
+            # Anything still pending is older than this event
+            self.pending.pop(session_code, None)
+            self.sent += 1
+            await self.broadcast(session_code, message)
+            return
+
+        self.pending[session_code] = message
+        if session_code not in self.timers:
+            self.timers[session_code] = asyncio.create_task(self._flush_after_tick(session_code))
+
+    async def _flush_after_tick(self, session_code: str):
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self.timers.pop(session_code, None)
+        message = self.pending.pop(session_code, None)
+        if message is not None:
+            self.sent += 1
+            await self.broadcast(session_code, message)
+
+    def discard(self, session_code: str):
+        self.pending.pop(session_code, None)
+        timer = self.timers.pop(session_code, None)
+        if timer is not None:
+            timer.cancel()
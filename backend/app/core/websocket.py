@@ -1,31 +1,149 @@
 from fastapi import APIRouter, WebSocket, Depends, Query, status
 from starlette.websockets import WebSocketDisconnect
+import asyncio
 import json
+import logging
+import os
 from app.core.database import get_db
 from app.models.session import Session as SessionModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from app.models.queue import Queue
-from app.core.auth import verify_token, TokenData
+from app.services.queue_index import queue_index
+from app.services.vote_buffer import vote_buffer
+from app.services.session_cache import session_cache
+from app.services.queue_positions import position_counter
+from app.core.auth import token_cache, TokenData
+from app.core import wire
+from app.core.playback import PlaybackSyncScheduler
+from app.core.backplane import InProcessBackplane
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# What to do with a client whose send queue is full: "drop" closes the
+# socket (it will reconnect and get a snapshot on join), "snapshot" discards
+# its backlog and sends the current queue snapshot instead.
+WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop")
+
+# Broadcasts that change a session's queue; see broadcast_queue_patch
+QUEUE_PATCH_TYPES = {"queue_updated", "vote_updated", "song_played", "queue_reordered"}
+
+class ClientConnection:
+    """A connected socket with its own bounded outbound queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, session_code: str, token_data: TokenData, max_queue: int = WS_SEND_QUEUE_SIZE, codec: str = wire.JSON):
+        self.websocket = websocket
+        self.session_code = session_code
+        self.token_data = token_data
+        self.codec = codec
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.writer: asyncio.Task | None = None
+        self.closed = False
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: wire.EncodedMessage) -> bool:
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(message.frame(self.codec))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def reset(self, message: wire.EncodedMessage):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message.frame(self.codec))
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Error sending to client in session {self.session_code}: {e}")
+        finally:
+            self.closed = True
+
+    async def close(self, code: int | None = None):
+        self.closed = True
+        if self.writer is not None:
+            self.writer.cancel()
+        if code is not None:
+            try:
+                await asyncio.wait_for(self.websocket.close(code=code), timeout=1)
+            except Exception:
+                pass
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_queue: int = WS_SEND_QUEUE_SIZE, slow_client_policy: str = WS_SLOW_CLIENT_POLICY, backplane: InProcessBackplane | None = None):
         self.active_connections: dict[str, list[WebSocket]] = {}
-        self.playback_states: dict[str, dict] = {}
         self.user_data: dict[WebSocket, TokenData] = {}
+        self.sequences: dict[str, int] = {}
+        self.clients: dict[WebSocket, ClientConnection] = {}
+        self.max_queue = max_queue
+        self.slow_client_policy = slow_client_policy
+        self.dropped_messages = 0
+        self.dropped_clients = 0
+        self.snapshots_sent = 0
+        self.playback = PlaybackSyncScheduler(self.broadcast)
+        self.backplane = backplane or InProcessBackplane()
+
+    async def start_backplane(self, backplane: InProcessBackplane):
+        await self.backplane.stop()
+        self.backplane = backplane
+        await backplane.start(self._deliver_remote, self._resync)
+
+    async def stop_backplane(self):
+        await self.backplane.stop()
+        self.backplane = InProcessBackplane()
+
+    async def next_sequence(self, session_code: str) -> int:
+        seq = await self.backplane.next_sequence(session_code)
+        self._seen_sequence(session_code, seq)
+        return seq
+
+    def _seen_sequence(self, session_code: str, seq: int):
+        # Tracked only while the session has sockets here; see queue_snapshot
+        if session_code in self.active_connections:
+            self.sequences[session_code] = max(seq, self.sequences.get(session_code, 0))
+
+    async def session_version(self, session_code: str) -> str:
+        """Changes whenever a queue patch is broadcast for the session, on any worker."""
+        return f"{self.backplane.epoch}.{await self.backplane.current_sequence(session_code)}"
 
-    async def connect(self, websocket: WebSocket, session_code: str, token_data: TokenData):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, session_code: str, token_data: TokenData, subprotocol: str | None = None):
+        await websocket.accept(subprotocol=subprotocol)
         if session_code not in self.active_connections:
             self.active_connections[session_code] = []
         self.active_connections[session_code].append(websocket)
         self.user_data[websocket] = token_data
+        client = ClientConnection(websocket, session_code, token_data, self.max_queue, wire.codec_for(subprotocol))
+        self.clients[websocket] = client
+        client.start()
         
-        print(f"Client connected to session {session_code} as {token_data.role}. Total: {len(self.active_connections[session_code])}")
+        count = await self.backplane.add_participants(session_code, 1)
+        print(f"Client connected to session {session_code} as {token_data.role}. Total: {count}")
+        await self.broadcast(session_code, {
+            "type": "participant_count_updated",
+            "count": count
+        })
+
+    async def leave(self, websocket: WebSocket, session_code: str):
+        self.disconnect(websocket, session_code)
+        count = await self.backplane.add_participants(session_code, -1)
         await self.broadcast(session_code, {
             "type": "participant_count_updated",
-            "count": len(self.active_connections[session_code])
+            "count": count
         })
 
     def disconnect(self, websocket: WebSocket, session_code: str):
@@ -35,35 +153,131 @@ class ConnectionManager:
                 print(f"Client disconnected from session {session_code}")
             if not self.active_connections[session_code]:
                 del self.active_connections[session_code]
+                self.sequences.pop(session_code, None)
+                self.playback.discard(session_code)
         if websocket in self.user_data:
             del self.user_data[websocket]
+        client = self.clients.pop(websocket, None)
+        if client is not None and client.writer is not None:
+            client.writer.cancel()
+
+    async def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one client, behind anything already queued for it."""
+        client = self.clients.get(websocket)
+        if client is not None and not client.enqueue(wire.EncodedMessage(message)):
+            self._handle_slow_client(client)
 
     async def broadcast(self, session_code: str, message: dict):
+        self._fan_out(session_code, message)
+        if self.backplane.distributed:
+            await self.backplane.publish(session_code, message)
+
+    async def relay_playback(self, session_code: str, message: dict):
+        """Record the host's playback state for joiners, then broadcast it (coalesced)."""
+        await self.backplane.set_playback_state(session_code, message)
+        await self.playback.submit(session_code, message)
+
+    async def _deliver_remote(self, session_code: str, message: dict):
+        # Another worker changed this session: our cached queue may be stale
+        if message.get("type") in QUEUE_PATCH_TYPES:
+            queue_index.invalidate(session_code)
+            position_counter.invalidate(session_code)
+        if "manual_sort" in message:
+            session_cache.invalidate(session_code)
+        if "seq" in message:
+            self._seen_sequence(session_code, message["seq"])
+        self._fan_out(session_code, message)
+
+    def _resync(self):
+        # Events from other workers may have been lost: forget everything cached
+        queue_index.invalidate()
+        session_cache.invalidate()
+        position_counter.invalidate()
+
+    def _fan_out(self, session_code: str, message: dict):
         if session_code in self.active_connections:
+            # Encoded lazily, once per codec, and shared by every connection
+            message = wire.EncodedMessage(message)
             for connection in list(self.active_connections[session_code]):
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    print(f"Error broadcasting to client: {e}")
+                client = self.clients.get(connection)
+                if client is not None and not client.enqueue(message):
+                    self._handle_slow_client(client)
+
+    def _handle_slow_client(self, client: ClientConnection):
+        self.dropped_messages += 1
+        if self.slow_client_policy == "snapshot":
+            index = queue_index.peek(client.session_code)
+            if index is not None:
+                client.reset(wire.EncodedMessage(snapshot_message(client.session_code, index)))
+                self.snapshots_sent += 1
+                return
+        logger.warning(f"Dropping slow client in session {client.session_code}")
+        self.dropped_clients += 1
+        self.disconnect(client.websocket, client.session_code)
+        asyncio.create_task(client.close(code=status.WS_1013_TRY_AGAIN_LATER))
+
+    def metrics(self) -> dict:
+        depths = [client.queue.qsize() for client in self.clients.values()]
+        return {
+            "sessions": len(self.active_connections),
+            "connections": len(self.clients),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_total": sum(depths),
+            "queue_capacity": self.max_queue,
+            "slow_client_policy": self.slow_client_policy,
+            "dropped_messages": self.dropped_messages,
+            "dropped_clients": self.dropped_clients,
+            "snapshots_sent": self.snapshots_sent,
+            "playback_sync_received": self.playback.received,
+            "playback_sync_sent": self.playback.sent,
+            "backplane": type(self.backplane).__name__,
+        }
 
 manager = ConnectionManager()
 
 async def broadcast_to_session(session_code: str, message: dict):
     await manager.broadcast(session_code, message)
 
+async def broadcast_queue_patch(session_code: str, message: dict):
+    """Broadcast a queue change stamped with the session's next sequence number.
+
+    Clients apply patches in `seq` order and send `{"type": "resync"}` when
+    they notice a gap, which is answered with a `queue_snapshot`.
+    """
+    message["seq"] = await manager.next_sequence(session_code)
+    await manager.broadcast(session_code, message)
+
+def snapshot_message(session_code: str, index) -> dict:
+    return {
+        "type": "queue_snapshot",
+        "seq": manager.sequences.get(session_code, 0),
+        "manual_sort": index.manual_sort,
+        "queue": [item.to_dict() for item in index.ranked()]
+    }
+
+async def queue_snapshot(db: AsyncSession, session_code: str) -> dict:
+    if session_code not in manager.sequences:
+        # First socket of the session on this worker
+        manager._seen_sequence(session_code, await manager.backplane.current_sequence(session_code))
+    return snapshot_message(session_code, await queue_index.get(db, session_code))
+
+@router.get("/ws/metrics")
+async def websocket_metrics():
+    return manager.metrics()
+
 @router.websocket("/ws/{session_code}")
 async def websocket_endpoint(
     websocket: WebSocket,
     session_code: str,
     token: str = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     if not token:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
         
     try:
-        token_data = verify_token(token)
+        token_data = token_cache.verify(token)
     except Exception as e:
         print(f"Token validation failed: {e}")
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -74,55 +288,61 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await manager.connect(websocket, session_code, token_data)
+    subprotocol = wire.negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, session_code, token_data, subprotocol)
     try:
-        if session_code in manager.playback_states:
-            await websocket.send_json(manager.playback_states[session_code])
+        await manager.send(websocket, await queue_snapshot(db, session_code))
+        playback_state = await manager.backplane.get_playback_state(session_code)
+        if playback_state is not None:
+            await manager.send(websocket, playback_state)
 
         while True:
+            # The session lives as long as the socket; don't hold a pooled
+            # connection while waiting for the next message.
+            await db.close()
             data = await websocket.receive_text()
             try:
                 message_data = json.loads(data)
                 
                 if message_data.get("type") == "playback_control":
                     if token_data.role != "host":
-                        await websocket.send_json({"type": "error", "message": "Only the host can control playback."})
+                        await manager.send(websocket, {"type": "error", "message": "Only the host can control playback."})
                         continue
                     
                     action = message_data.get("action")
                     if action == "next":
-                        current_queue_items = db.query(Queue).filter(
-                            Queue.session_code == session_code,
-                            Queue.played == False
-                        ).order_by(Queue.votes.desc(), Queue.id.asc()).all()
-
-                        if len(current_queue_items) > 0:
-                            song_to_mark_played = current_queue_items[0]
-                            song_to_mark_played.played = True
-                            db.add(song_to_mark_played)
-                            db.commit()
-                            
-                            updated_queue_items = db.query(Queue).filter(
-                                Queue.session_code == session_code,
-                                Queue.played == False
-                            ).order_by(Queue.votes.desc(), Queue.id.asc()).all()
-
-                            await manager.broadcast(session_code, {
+                        index = await queue_index.get(db, session_code)
+                        song_to_mark_played = index.top()
+
+                        if song_to_mark_played is not None:
+                            await db.execute(update(Queue)
+                                            .where(Queue.id == song_to_mark_played.id)
+                                            .values(played=True))
+                            await db.commit()
+                            index = queue_index.for_update(session_code)
+                            if index is not None:
+                                index.remove(song_to_mark_played.id)
+                            vote_buffer.retire(song_to_mark_played.id)
+
+                            await broadcast_queue_patch(session_code, {
                                 "type": "queue_updated",
-                                "queue": [item.to_dict() for item in updated_queue_items]
+                                "action": "removed",
+                                "queue_id": song_to_mark_played.id
                             })
                         else:
-                            await websocket.send_json({"type": "info", "message": "End of Queue"})
+                            await manager.send(websocket, {"type": "info", "message": "End of Queue"})
                     elif action == "previous":
-                        await websocket.send_json({"type": "info", "message": "Previous song functionality not yet fully implemented server-side."})
+                        await manager.send(websocket, {"type": "info", "message": "Previous song functionality not yet fully implemented server-side."})
                 
                 elif message_data.get("type") == "playback_sync":
                     if token_data.role != "host":
-                        await websocket.send_json({"type": "error", "message": "Only the host can send playback sync data."})
+                        await manager.send(websocket, {"type": "error", "message": "Only the host can send playback sync data."})
                         continue
                     
-                    manager.playback_states[session_code] = message_data
-                    await manager.broadcast(session_code, message_data)
+                    await manager.relay_playback(session_code, message_data)
+
+                elif message_data.get("type") == "resync":
+                    await manager.send(websocket, await queue_snapshot(db, session_code))
 
                 else:
                     # Generic broadcasting (e.g., chat, though not implemented yet)
@@ -131,15 +351,7 @@ async def websocket_endpoint(
             except json.JSONDecodeError:
                 pass
     except WebSocketDisconnect:
-        manager.disconnect(websocket, session_code)
-        await manager.broadcast(session_code, {
-            "type": "participant_count_updated",
-            "count": len(manager.active_connections.get(session_code, []))
-        })
+        await manager.leave(websocket, session_code)
     except Exception as e:
         print(f"WebSocket error: {e}")
-        manager.disconnect(websocket, session_code)
-        await manager.broadcast(session_code, {
-            "type": "participant_count_updated",
-            "count": len(manager.active_connections.get(session_code, []))
-        })
+        await manager.leave(websocket, session_code)
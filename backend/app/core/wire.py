@@ -0,0 +1,60 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - binary subprotocol is optional
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Sec-WebSocket-Protocol value a client offers to receive MessagePack frames
+MSGPACK_SUBPROTOCOL = "aura.msgpack"
+
+# Only the high-volume frames are sent as binary; everything else stays JSON
+# text so msgpack clients can share the generic message handling.
+BINARY_MESSAGE_TYPES = {"queue_updated", "vote_updated", "playback_sync"}
+
+
+def encode_json(message: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"))
+
+
+def encode_msgpack(message: dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def negotiate_subprotocol(offered: list[str]) -> str | None:
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def codec_for(subprotocol: str | None) -> str:
+    return MSGPACK if subprotocol == MSGPACK_SUBPROTOCOL else JSON
+
+
+class EncodedMessage:
+    """A message encoded at most once per codec, however many sockets receive it."""
+
+    __slots__ = ("message", "_frames")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._frames: dict[str, str | bytes] = {}
+
+    def frame(self, codec: str) -> str | bytes:
+        if codec == MSGPACK and self.message.get("type") not in BINARY_MESSAGE_TYPES:
+            codec = JSON
+        frame = self._frames.get(codec)
+        if frame is None:
+            frame = encode_msgpack(self.message) if codec == MSGPACK else encode_json(self.message)
+            self._frames[codec] = frame
+        return frame
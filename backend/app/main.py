@@ -1,13 +1,49 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.routes import session, queue, jamendo, spotify, search
-from app.core.websocket import router as ws_router
-from app.core.database import Base, engine
+from app.core.websocket import router as ws_router, manager
+from app.core.backplane import create_backplane
+from app.services.vote_buffer import vote_buffer
+from app.services.jamendo_client import jamendo_client
+from app.services.youtube_client import youtube_provider
+from app.services.track_catalog import track_catalog
+from app.services.qr_codes import qr_codes
+from app.services.queue_positions import queue_rebalancer
+from app.core.database import async_engine, describe_engine, AsyncSessionLocal
+from app.core.migrations import migrate
 
-# Initialize database
-Base.metadata.create_all(bind=engine)
+# Responses of at least this many bytes are gzipped for clients that accept it
+HTTP_GZIP_MIN_SIZE = int(os.getenv("HTTP_GZIP_MIN_SIZE", "1024"))
+# zlib level 1-9; 0 turns response compression off
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "5"))
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = await describe_engine(async_engine)
+    print("Database: " + ", ".join(f"{key}={value}" for key, value in settings.items()))
+    async with async_engine.begin() as connection:
+        applied = await connection.run_sync(migrate)
+    if applied:
+        print(f"Database: applied migrations {applied}")
+    async with AsyncSessionLocal() as db:
+        await track_catalog.load(db)
+    await manager.start_backplane(create_backplane())
+    await vote_buffer.start()
+    await jamendo_client.start()
+    await youtube_provider.start()
+    yield
+    await youtube_provider.close()
+    qr_codes.close()
+    await jamendo_client.close()
+    await queue_rebalancer.stop()
+    await vote_buffer.stop()
+    await manager.stop_backplane()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS for frontend
 app.add_middleware(
@@ -16,7 +52,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+if HTTP_GZIP_LEVEL > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=HTTP_GZIP_MIN_SIZE, compresslevel=HTTP_GZIP_LEVEL)
 
 app.include_router(session.router, prefix="/session")
 app.include_router(queue.router, prefix="/queue")
@@ -27,4 +66,4 @@ app.include_router(ws_router)
 
 @app.get("/")
 async def root():
-    return {"message": "Aura Vibe API"}
\ No newline at end of file
+    return {"message": "Aura Vibe API"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index
 from app.core.database import Base
 from pydantic import BaseModel, Field
 from typing import List
@@ -18,6 +18,12 @@ class Queue(Base):
     played = Column(Boolean, default=False, nullable=False)
     position = Column(Integer, default=0, nullable=False)
 
+    # Created by migration 2 (app/core/migrations.py)
+    __table_args__ = (
+        Index("ix_queue_session_votes", session_code, played, votes.desc(), id),
+        Index("ix_queue_session_position", session_code, played, position, id),
+    )
+
     def to_dict(self):
         return {
             "id": self.song_id, # Jamendo ID
@@ -38,6 +44,10 @@ class UserVote(Base):
     queue_id = Column(Integer, ForeignKey("queue.id"), primary_key=True)
     vote_type = Column(Boolean, nullable=False) # True for upvote, False for downvote
 
+    __table_args__ = (
+        Index("ix_user_votes_user_queue_type", user_id, queue_id, vote_type),
+    )
+
 # Pydantic Models (Schemas)
 
 # For API Responses to match frontend expectations
@@ -51,6 +61,7 @@ class SongResponse(BaseModel):
     added_by: str
     votes: int
     user_vote_type: bool | None = None # True for upvote, False for downvote, None if no vote
+    rank: int | None = None # 1-based place in the queue, set by the window listing
 
     class Config:
         from_attributes = True
@@ -75,11 +86,20 @@ class AddSongRequest(BaseModel):
     session_code: str
     song_data: SongData
 
+class AddSongsRequest(BaseModel):
+    session_code: str
+    songs: List[SongData]
+
 
 class QueueReorder(BaseModel):
     session_code: str
     order: List[int]
 
+class QueueMove(BaseModel):
+    session_code: str
+    queue_id: int
+    after_id: int | None = None # None moves the song to the top
+
 class QueueItem(QueueCreate):
     id: int
     votes: int
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, HTTPException, Depends
-from app.services.jamendo_client import jamendo_client, JamendoClient
+from app.services.jamendo_client import jamendo_client
+from app.services.upstream import search_provider, SearchError
 
 router = APIRouter()
 
 @router.get("/search")
 async def search_tracks(query: str):
-    tracks, error = jamendo_client.search_tracks(query)
-    if error:
-        raise HTTPException(status_code=500, detail=error)
+    try:
+        tracks = await search_provider(jamendo_client, query)
+    except SearchError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     return {"tracks": tracks}
\ No newline at end of file
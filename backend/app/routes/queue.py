@@ -1,111 +1,166 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import update, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select, update
 from typing import List
 from app.core.database import get_db
-from app.models.queue import Queue, QueueReorder, AddSongRequest, SongResponse, UserVote
+from app.models.queue import Queue, QueueReorder, QueueMove, AddSongRequest, AddSongsRequest, SongData, SongResponse
 from app.models.session import Session as SessionModel
-from app.core.websocket import broadcast_to_session
+from app.services.queue_read_model import InvalidCursor, ranked_page, ranked_queue, ranked_window, song_response
+from app.services.queue_index import queue_index, QueueEntry
+from app.services.vote_buffer import vote_buffer
+from app.services.votes import record_vote
+from app.services.track_catalog import track_catalog
+from app.services.session_cache import session_cache
+from app.services.queue_positions import (bulk_set_positions, claim_session_queue, neighbour_positions, position_between,
+                                          position_counter, queue_rebalancer, spaced_positions)
+from app.core.websocket import broadcast_queue_patch, manager
+from app.core.etags import etag_matches, weak_etag
 from app.core.auth import get_current_user, TokenData
 import logging
+import os
 
 router = APIRouter(tags=["queue"])
 logger = logging.getLogger(__name__)
 
+QUEUE_ADD_BATCH_MAX = int(os.getenv("QUEUE_ADD_BATCH_MAX", "500"))
+QUEUE_PAGE_SIZE = int(os.getenv("QUEUE_PAGE_SIZE", "50"))
+QUEUE_PAGE_MAX = int(os.getenv("QUEUE_PAGE_MAX", "500"))
+QUEUE_INSERT_COLUMNS = ("session_code", "song_id", "song_title", "artist_name", "song_url", "image", "added_by", "votes", "played", "position")
+
+def queue_row(session_code: str, song: SongData, added_by: str, position: int) -> Queue:
+    return Queue(
+        session_code=session_code,
+        song_id=song.id,
+        song_title=song.name,
+        artist_name=song.artist_name,
+        song_url=song.audio,
+        image=song.image,
+        added_by=added_by,
+        votes=0,
+        played=False,
+        position=position
+    )
+
 @router.post("/add", response_model=SongResponse)
-async def add_to_queue(item: AddSongRequest, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def add_to_queue(item: AddSongRequest, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     if current_user.session_code != item.session_code:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
 
-    db_session = db.query(SessionModel).filter(SessionModel.session_code == item.session_code).first()
-    if not db_session:
+    if await session_cache.get(db, item.session_code) is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    max_pos = db.query(func.max(Queue.position)).filter(Queue.session_code == item.session_code).scalar() or 0
-    
-    db_item = Queue(
-        session_code=item.session_code,
-        song_id=item.song_data.id,
-        song_title=item.song_data.name,
-        artist_name=item.song_data.artist_name,
-        song_url=item.song_data.audio,
-        image=item.song_data.image,
-        added_by=current_user.user_id,
-        votes=0,
-        played=False,
-        position=max_pos + 1
-    )
+    position, = await position_counter.reserve(db, item.session_code)
+    db_item = queue_row(item.session_code, item.song_data, current_user.user_id, position)
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    await db.commit()
+
+    entry = QueueEntry.from_model(db_item)
+    index = queue_index.for_update(item.session_code)
+    if index is not None:
+        index.add(entry)
+    track_catalog.record_queued(item.song_data.model_dump())
     
     # Broadcast to WebSocket
-    await broadcast_to_session(item.session_code, {
+    await broadcast_queue_patch(item.session_code, {
         "type": "queue_updated",
         "queue_id": db_item.id,
-        "action": "added"
+        "action": "added",
+        "item": entry.to_dict()
     })
     
-    return SongResponse(
-        id=db_item.id,
-        song_id=db_item.song_id,
-        name=db_item.song_title,
-        artist_name=db_item.artist_name,
-        audio=db_item.song_url,
-        image=db_item.image,
-        added_by=db_item.added_by,
-        votes=db_item.votes,
-        user_vote_type=None
-    )
+    return song_response(db_item)
+
+@router.post("/add-batch", response_model=List[SongResponse])
+async def add_songs_to_queue(batch: AddSongsRequest, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    if current_user.session_code != batch.session_code:
+        raise HTTPException(status_code=403, detail="Not authorized for this session")
+
+    if not batch.songs or len(batch.songs) > QUEUE_ADD_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"A batch must contain 1 to {QUEUE_ADD_BATCH_MAX} songs")
+
+    if await session_cache.get(db, batch.session_code) is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    positions = await position_counter.reserve(db, batch.session_code, len(batch.songs))
+    db_items = [queue_row(batch.session_code, song, current_user.user_id, position) for song, position in zip(batch.songs, positions)]
+    # One multi-row INSERT; positions are unique within the batch, so they
+    # map the returned ids back to the songs whatever order rows come in
+    rows = [{column: getattr(db_item, column) for column in QUEUE_INSERT_COLUMNS} for db_item in db_items]
+    ids = dict((await db.execute(insert(Queue).values(rows).returning(Queue.position, Queue.id))).all())
+    await db.commit()
+    for db_item in db_items:
+        db_item.id = ids[db_item.position]
+
+    entries = [QueueEntry.from_model(db_item) for db_item in db_items]
+    index = queue_index.for_update(batch.session_code)
+    if index is not None:
+        for entry in entries:
+            index.add(entry)
+    for song in batch.songs:
+        track_catalog.record_queued(song.model_dump())
+
+    # One patch for the whole batch
+    await broadcast_queue_patch(batch.session_code, {
+        "type": "queue_updated",
+        "action": "added_batch",
+        "queue_ids": [entry.id for entry in entries],
+        "items": [entry.to_dict() for entry in entries]
+    })
+
+    return [song_response(db_item) for db_item in db_items]
 
 @router.get("/list/{session_code}", response_model=List[SongResponse], response_model_by_alias=False)
-async def list_queue(session_code: str, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def list_queue(
+    session_code: str,
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=QUEUE_PAGE_MAX),
+    cursor: str | None = None,
+    window: int | None = Query(None, ge=0, le=QUEUE_PAGE_MAX),
+    db: AsyncSession = Depends(get_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """The ranked unplayed queue.
+
+    With `limit` (and the `cursor` from the previous page's X-Next-Cursor
+    header) the queue is returned page by page. With `window=N` it is the
+    top N songs plus the caller's own songs further down, each with its
+    `rank`. Without either, the whole queue.
+
+    Responses carry a weak ETag built from the session version (bumped by
+    every queue patch), the caller and the query; a matching
+    If-None-Match is answered with 304 before the queue is read.
+    """
     if current_user.session_code != session_code:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
 
-    db_session = db.query(SessionModel).filter(SessionModel.session_code == session_code).first()
-    manual_sort = db_session.manual_sort if db_session else False
+    etag = weak_etag("queue", session_code, await manager.session_version(session_code),
+                     current_user.user_id, request.url.query)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
 
-    if manual_sort:
-        items = db.query(Queue).filter(
-            Queue.session_code == session_code,
-            Queue.played == False,
-            Queue.song_url.isnot(None)
-        ).order_by(Queue.position.asc(), Queue.id.asc()).all()
-    else:
-        items = db.query(Queue).filter(
-            Queue.session_code == session_code,
-            Queue.played == False,
-            Queue.song_url.isnot(None)
-        ).order_by(Queue.votes.desc(), Queue.id.asc()).all()
-    
-    response_items = []
-    for item in items:
-        user_vote = db.query(UserVote).filter(
-            UserVote.user_id == current_user.user_id,
-            UserVote.queue_id == item.id
-        ).first()
-        
-        user_vote_type = None
-        if user_vote:
-            user_vote_type = user_vote.vote_type
-            
-        response_items.append(SongResponse(
-            id=item.id,
-            song_id=item.song_id,
-            name=item.song_title,
-            artist_name=item.artist_name,
-            audio=item.song_url,
-            image=item.image,
-            added_by=item.added_by,
-            votes=item.votes,
-            user_vote_type=user_vote_type
-        ))
-    
-    return response_items
+    if window is not None:
+        if limit is not None or cursor is not None:
+            raise HTTPException(status_code=400, detail="window cannot be combined with limit or cursor")
+        items = await ranked_window(db, session_code, current_user.user_id, window)
+        return [song_response(item, user_vote_type, rank) for rank, item, user_vote_type in items]
+
+    if limit is not None or cursor is not None:
+        try:
+            items, next_cursor = await ranked_page(db, session_code, current_user.user_id, limit or QUEUE_PAGE_SIZE, cursor)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return [song_response(item, user_vote_type) for item, user_vote_type in items]
+
+    items = await ranked_queue(db, session_code, user_id=current_user.user_id)
+    return [song_response(item, user_vote_type) for item, user_vote_type in items]
 
 @router.post("/vote")
-async def vote_on_song(vote_data: dict, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def vote_on_song(vote_data: dict, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     required = ["session_code", "queue_id", "vote"]
     if not all(key in vote_data for key in required):
         raise HTTPException(status_code=400, detail="Missing required fields")
@@ -113,69 +168,32 @@ async def vote_on_song(vote_data: dict, db: Session = Depends(get_db), current_u
     if current_user.session_code != vote_data["session_code"]:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
     
-    queue_item = db.query(Queue).filter(
-        Queue.id == vote_data["queue_id"],
-        Queue.session_code == vote_data["session_code"]
-    ).first()
-    
-    if not queue_item:
-        raise HTTPException(status_code=404, detail="Queue item not found")
-    
     vote_type = vote_data["vote"] # True for upvote, False for downvote
-    
-    existing_user_vote = db.query(UserVote).filter(
-        UserVote.user_id == current_user.user_id,
-        UserVote.queue_id == queue_item.id
-    ).first()
-    
-    new_user_vote_type = None
-
-    if existing_user_vote:
-        if existing_user_vote.vote_type == vote_type:
-            # User is revoking their vote
-            if vote_type: # Was an upvote
-                queue_item.votes -= 1
-            else: # Was a downvote
-                queue_item.votes += 1
-            db.delete(existing_user_vote)
-            new_user_vote_type = None
-        else:
-            # User is changing their vote
-            if vote_type: # New vote is upvote
-                queue_item.votes += 2
-            else: # New vote is downvote
-                queue_item.votes -= 2
-            existing_user_vote.vote_type = vote_type
-            db.add(existing_user_vote)
-            new_user_vote_type = vote_type
+
+    if vote_buffer.enabled:
+        # Write-behind: the tally is updated in memory and written on the next flush
+        result = await vote_buffer.vote(db, vote_data["session_code"], vote_data["queue_id"], current_user.user_id, vote_type)
     else:
-        # New vote
-        if vote_type:
-            queue_item.votes += 1
-        else:
-            queue_item.votes -= 1
-        
-        new_vote = UserVote(
-            user_id=current_user.user_id,
-            queue_id=queue_item.id,
-            vote_type=vote_type
-        )
-        db.add(new_vote)
-        new_user_vote_type = vote_type
-            
-    db.commit()
-    db.refresh(queue_item)
+        result = await record_vote(db, vote_data["session_code"], vote_data["queue_id"], current_user.user_id, vote_type)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Queue item not found")
+    # Net change, so revoked and flipped upvotes are taken back
+    track_catalog.record_upvote(result.song_id, result.upvotes)
+
+    index = queue_index.for_update(vote_data["session_code"])
+    if index is not None:
+        index.update_votes(vote_data["queue_id"], result.votes)
     
-    await broadcast_to_session(vote_data["session_code"], {
+    await broadcast_queue_patch(vote_data["session_code"], {
         "type": "vote_updated",
-        "queue_id": queue_item.id,
-        "votes": queue_item.votes
+        "queue_id": vote_data["queue_id"],
+        "votes": result.votes
     })
     
-    return {"message": "Vote recorded", "votes": queue_item.votes, "user_vote_type": new_user_vote_type}
+    return {"message": "Vote recorded", "votes": result.votes, "user_vote_type": result.user_vote_type}
 
 @router.post("/play")
-async def play_song(play_data: dict, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def play_song(play_data: dict, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     if current_user.role != "host":
         raise HTTPException(status_code=403, detail="Only the host can play songs")
 
@@ -186,10 +204,10 @@ async def play_song(play_data: dict, db: Session = Depends(get_db), current_user
     if current_user.session_code != play_data["session_code"]:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
     
-    item = db.query(Queue).filter(
+    item = (await db.execute(select(Queue).filter(
         Queue.id == play_data["queue_id"],
         Queue.session_code == play_data["session_code"]
-    ).first()
+    ))).scalar_one_or_none()
     
     if not item:
         raise HTTPException(status_code=404, detail="Queue item not found")
@@ -198,55 +216,64 @@ async def play_song(play_data: dict, db: Session = Depends(get_db), current_user
         raise HTTPException(status_code=400, detail="Song already played")
     
     item.played = True
-    db.commit()
+    await db.commit()
+
+    index = queue_index.for_update(play_data["session_code"])
+    if index is not None:
+        index.remove(item.id)
+    vote_buffer.retire(item.id)
     
-    await broadcast_to_session(play_data["session_code"], {
+    await broadcast_queue_patch(play_data["session_code"], {
         "type": "song_played",
-        "queue_id": play_data["queue_id"],
+        "action": "removed",
+        "queue_id": item.id,
         "song_title": item.song_title
     })
     
     return {"message": f"Playing: {item.song_title}"}
 
 @router.post("/reorder")
-async def reorder_queue(reorder_data: QueueReorder, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def reorder_queue(reorder_data: QueueReorder, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     if current_user.role != "host":
         raise HTTPException(status_code=403, detail="Only the host can reorder the queue")
 
     if current_user.session_code != reorder_data.session_code:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
 
-    session = db.query(SessionModel).filter(SessionModel.session_code == reorder_data.session_code).first()
-    if not session:
+    if await session_cache.get(db, reorder_data.session_code) is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    items = db.query(Queue).filter(
-        Queue.session_code == reorder_data.session_code,
-        Queue.played == False
-    ).all()
-    
-    existing_ids = [item.id for item in items]
-    reorder_ids = reorder_data.order
-    
-    if set(reorder_ids) != set(existing_ids):
-        raise HTTPException(status_code=400, detail="Invalid order: missing or extra IDs")
-    
-    for new_pos, queue_id in enumerate(reorder_ids, 1):
-        db.execute(update(Queue)
-                  .where(Queue.id == queue_id)
-                  .values(position=new_pos))
-    
-    session.manual_sort = True
-    db.commit()
-    
-    reordered_items = db.query(Queue).filter(
-        Queue.session_code == reorder_data.session_code,
-        Queue.played == False
-    ).order_by(Queue.position).all()
-    
-    await broadcast_to_session(reorder_data.session_code, {
+    async with queue_rebalancer.lock(reorder_data.session_code):
+        await claim_session_queue(db, reorder_data.session_code, manual_sort=True)
+        existing_ids = (await db.execute(select(Queue.id).filter(
+            Queue.session_code == reorder_data.session_code,
+            Queue.played == False
+        ))).scalars().all()
+        reorder_ids = reorder_data.order
+
+        if set(reorder_ids) != set(existing_ids):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Invalid order: missing or extra IDs")
+
+        positions = spaced_positions(reorder_ids)
+        await bulk_set_positions(db, reorder_data.session_code, positions)
+        if positions:
+            position_counter.observe(reorder_data.session_code, *positions.values())
+        await db.commit()
+        session_cache.set_manual_sort(reorder_data.session_code, True)
+
+        index = queue_index.for_update(reorder_data.session_code)
+        if index is not None:
+            index.set_positions(positions)
+            index.manual_sort = True
+
+    reordered_items = (await queue_index.get(db, reorder_data.session_code)).by_position()
+
+    await broadcast_queue_patch(reorder_data.session_code, {
         "type": "queue_reordered",
-        "queue": [{"id": item.id, "song_title": item.song_title, "votes": item.votes} for item in reordered_items]
+        "action": "moved",
+        "manual_sort": True,
+        "order": [item.id for item in reordered_items]
     })
     
     return {
@@ -254,8 +281,69 @@ async def reorder_queue(reorder_data: QueueReorder, db: Session = Depends(get_db
         "queue": reordered_items
     }
 
+@router.post("/move")
+async def move_song(move: QueueMove, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    if current_user.role != "host":
+        raise HTTPException(status_code=403, detail="Only the host can reorder the queue")
+
+    if current_user.session_code != move.session_code:
+        raise HTTPException(status_code=403, detail="Not authorized for this session")
+
+    if move.after_id == move.queue_id:
+        raise HTTPException(status_code=400, detail="Cannot move a song after itself")
+
+    if await session_cache.get(db, move.session_code) is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    async with queue_rebalancer.lock(move.session_code):
+        await claim_session_queue(db, move.session_code, manual_sort=True)
+        moved = (await db.execute(select(Queue.id).filter(
+            Queue.id == move.queue_id,
+            Queue.session_code == move.session_code,
+            Queue.played == False
+        ))).scalar()
+        neighbours = await neighbour_positions(db, move.session_code, move.queue_id, move.after_id)
+        if moved is None or neighbours is None:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Queue item not found")
+
+        before, after = neighbours
+        position = position_between(before, after)
+        rebalanced = {}
+        if position is None:
+            # No room left between the neighbours: respace the queue first
+            rebalanced = await queue_rebalancer.rebalance(db, move.session_code)
+            before, after = await neighbour_positions(db, move.session_code, move.queue_id, move.after_id)
+            position = position_between(before, after)
+
+        # Only the moved row is written
+        await db.execute(update(Queue)
+                        .where(Queue.id == move.queue_id, Queue.session_code == move.session_code)
+                        .values(position=position))
+        await db.commit()
+        session_cache.set_manual_sort(move.session_code, True)
+
+        # Reloaded if it was dropped meanwhile; the reload already has the move
+        index = queue_index.for_update(move.session_code) or await queue_index.get(db, move.session_code)
+        index.set_positions({**rebalanced, move.queue_id: position})
+        position_counter.observe(move.session_code, position)
+        index.manual_sort = True
+        if queue_rebalancer.needs_rebalance(before, position, after):
+            queue_rebalancer.schedule(move.session_code)
+
+    await broadcast_queue_patch(move.session_code, {
+        "type": "queue_reordered",
+        "action": "moved",
+        "manual_sort": True,
+        "queue_id": move.queue_id,
+        "after_id": move.after_id,
+        "order": [entry.id for entry in index.by_position()]
+    })
+
+    return {"message": "Song moved", "queue_id": move.queue_id, "position": position}
+
 @router.post("/toggle-smart-sort")
-async def toggle_smart_sort(data: dict, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def toggle_smart_sort(data: dict, db: AsyncSession = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     if current_user.role != "host":
         raise HTTPException(status_code=403, detail="Only the host can toggle smart sort")
         
@@ -265,27 +353,25 @@ async def toggle_smart_sort(data: dict, db: Session = Depends(get_db), current_u
     if current_user.session_code != session_code:
         raise HTTPException(status_code=403, detail="Not authorized for this session")
         
-    db_session = db.query(SessionModel).filter(SessionModel.session_code == session_code).first()
-    if not db_session:
+    if await session_cache.get(db, session_code) is None:
         raise HTTPException(status_code=404, detail="Session not found")
-        
-    db_session.manual_sort = not enabled
-    db.commit()
-    
-    if db_session.manual_sort:
-        items = db.query(Queue).filter(
-            Queue.session_code == session_code,
-            Queue.played == False
-        ).order_by(Queue.position.asc(), Queue.id.asc()).all()
-    else:
-        items = db.query(Queue).filter(
-            Queue.session_code == session_code,
-            Queue.played == False
-        ).order_by(Queue.votes.desc(), Queue.id.asc()).all()
-        
-    await broadcast_to_session(session_code, {
+
+    manual_sort = not enabled
+    await db.execute(update(SessionModel)
+                    .where(SessionModel.session_code == session_code)
+                    .values(manual_sort=manual_sort))
+    await db.commit()
+    session_cache.set_manual_sort(session_code, manual_sort)
+
+    index = queue_index.for_update(session_code) or await queue_index.get(db, session_code)
+    index.manual_sort = manual_sort
+    items = index.ranked()
+
+    await broadcast_queue_patch(session_code, {
         "type": "queue_reordered",
-        "queue": [{"id": item.id, "song_title": item.song_title, "votes": item.votes} for item in items]
+        "action": "moved",
+        "manual_sort": manual_sort,
+        "order": [item.id for item in items]
     })
     
-    return {"message": "Sort mode updated", "manual_sort": db_session.manual_sort}
\ No newline at end of file
+    return {"message": "Sort mode updated", "manual_sort": manual_sort}
\ No newline at end of file
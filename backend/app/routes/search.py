@@ -1,57 +1,49 @@
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from app.core.wire import encode_json
 from app.services.jamendo_client import jamendo_client
-import os
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from app.services.youtube_client import youtube_provider
+from app.services.search_cache import search_cache
+from app.services.track_catalog import track_catalog
+from app.services.upstream import search_provider, SearchError
+from app.services.federated_search import federated_search, stream_federated_search
 
 router = APIRouter()
 
-YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+def search_providers():
+    """Providers queried by provider=all, in result order."""
+    return [jamendo_client, youtube_provider]
 
 @router.get("/")
 async def search(
     query: str, 
-    provider: str = Query("jamendo", enum=["jamendo", "youtube", "spotify"])
+    provider: str = Query("jamendo", enum=["jamendo", "youtube", "spotify", "all"]),
+    stream: bool = False
 ):
-    if provider == "jamendo":
-        tracks, error = jamendo_client.search_tracks(query)
-        if error:
-            raise HTTPException(status_code=500, detail=error)
+    if provider == "all":
+        # Every provider at once under one deadline; with stream=true each
+        # provider's results are sent as an NDJSON line as soon as they arrive
+        if stream:
+            async def lines():
+                async for message in stream_federated_search(search_providers(), query):
+                    yield encode_json(message) + "\n"
+            # "identity" keeps the GZip middleware from holding lines back in its buffer
+            return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Content-Encoding": "identity"})
+        return await federated_search(search_providers(), query)
+
+    elif provider == "jamendo":
+        try:
+            tracks = await search_provider(jamendo_client, query)
+        except SearchError as e:
+            raise HTTPException(status_code=500, detail=str(e))
         return {"provider": "jamendo", "tracks": tracks}
     
     elif provider == "youtube":
-        if not YOUTUBE_API_KEY:
-            raise HTTPException(status_code=500, detail="YouTube API key not configured")
-        
         try:
-            youtube = build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-            
-            search_response = youtube.search().list(
-                q=query,
-                part="snippet",
-                maxResults=10,
-                type="video",
-                topicId="/m/04rlf",  # Music topic
-                videoCategoryId="10" # Music category
-            ).execute()
-            
-            tracks = []
-            for item in search_response.get("items", []):
-                snippet = item["snippet"]
-                video_id = item["id"]["videoId"]
-                tracks.append({
-                    "id": video_id,
-                    "name": snippet["title"],
-                    "artist_name": snippet["channelTitle"],
-                    "audio": f"https://www.youtube.com/watch?v={video_id}",
-                    "image": snippet["thumbnails"]["high"]["url"]
-                })
-            return {"provider": "youtube", "tracks": tracks}
-
-        except HttpError as e:
-            raise HTTPException(status_code=e.resp.status, detail=str(e))
-        except Exception as e:
+            tracks = await search_provider(youtube_provider, query)
+        except SearchError as e:
             raise HTTPException(status_code=500, detail=str(e))
+        return {"provider": "youtube", "tracks": tracks}
 
     elif provider == "spotify":
         # Placeholder for Spotify search logic
@@ -59,3 +51,12 @@ async def search(
         
     else:
         raise HTTPException(status_code=400, detail="Invalid search provider")
+
+@router.get("/suggest")
+async def suggest(query: str, limit: int = Query(8, ge=1, le=50)):
+    """Instant autocomplete from tracks already queued or seen in searches."""
+    return {"query": query, "tracks": [track.to_dict() for track in track_catalog.suggest(query, limit)]}
+
+@router.get("/cache/stats")
+async def search_cache_stats():
+    return search_cache.stats()
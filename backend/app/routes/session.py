@@ -1,29 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session as DbSession
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession as DbSession
 from app.core.database import get_db
 from app.models.session import Session, SessionCreate, SessionOut, SessionJoin
 from app.core.auth import create_access_token
+from app.services.qr_codes import qr_codes, MEDIA_TYPES
+from app.services.session_cache import session_cache, SessionInfo
+from app.core.etags import etag_matches, weak_etag
+from app.core.websocket import manager
 import uuid
-import qrcode
-import base64
-from io import BytesIO
 
 router = APIRouter()
 
+# QR codes are rendered on demand by GET /session/{code}/qr and never change
+QR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def qr_code_url(session_code: str) -> str:
+    return f"/session/{session_code}/qr"
+
 @router.post("/create", response_model=SessionOut)
 async def create_session(session: SessionCreate, db: DbSession = Depends(get_db)):
     session_code = str(uuid.uuid4())[:8]
-    while db.query(Session).filter(Session.session_code == session_code).first():
+    while (await db.execute(select(Session).filter(Session.session_code == session_code))).scalar_one_or_none():
         session_code = str(uuid.uuid4())[:8]
     
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(session_code)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    qr_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    
     host_id = str(uuid.uuid4())
     
     db_session = Session(
@@ -33,14 +34,15 @@ async def create_session(session: SessionCreate, db: DbSession = Depends(get_db)
         duration=session.duration
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    await db.refresh(db_session)
+    session_cache.put(SessionInfo.from_model(db_session))
     
     token = create_access_token({"user_id": host_id, "session_code": session_code, "role": "host"})
     
     return SessionOut(
         session_code=session_code,
-        qr_code=qr_base64,
+        qr_code=qr_code_url(session_code),
         host_id=host_id,
         name=db_session.name,
         duration=db_session.duration,
@@ -50,7 +52,7 @@ async def create_session(session: SessionCreate, db: DbSession = Depends(get_db)
 
 @router.post("/join")
 async def join_session(join: SessionJoin, db: DbSession = Depends(get_db)):
-    db_session = db.query(Session).filter(Session.session_code == join.session_code).first()
+    db_session = await session_cache.get(db, join.session_code)
     if not db_session:
         raise HTTPException(status_code=404, detail="Session not found")
         
@@ -64,15 +66,43 @@ async def join_session(join: SessionJoin, db: DbSession = Depends(get_db)):
     }
 
 @router.get("/{session_code}")
-async def get_session(session_code: str, db: DbSession = Depends(get_db)):
-    db_session = db.query(Session).filter(Session.session_code == session_code).first()
+async def get_session(session_code: str, request: Request, db: DbSession = Depends(get_db)):
+    # Read the version before the data: a change in between only costs the
+    # client one more full response
+    etag = weak_etag("session", session_code, await manager.session_version(session_code))
+    db_session = await session_cache.get(db, session_code)
     if not db_session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return {
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({
         "session_code": db_session.session_code,
-        "qr_code": "",
+        "qr_code": qr_code_url(db_session.session_code),
         "host_id": db_session.host_id,
         "name": db_session.name,
         "duration": db_session.duration,
         "manual_sort": db_session.manual_sort
-    }
\ No newline at end of file
+    }, headers=headers)
+
+@router.get("/{session_code}/qr")
+async def get_session_qr(
+    session_code: str,
+    request: Request,
+    image_format: str = Query("png", alias="format", enum=["png", "svg"]),
+    db: DbSession = Depends(get_db)
+):
+    if image_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid QR code format")
+
+    entry = qr_codes.peek(session_code, image_format)
+    if entry is None:
+        if await session_cache.get(db, session_code) is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        entry = await qr_codes.render(session_code, image_format)
+
+    etag, image = entry
+    headers = {"ETag": etag, "Cache-Control": QR_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=image, media_type=MEDIA_TYPES[image_format], headers=headers)
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator
+from app.services.search_cache import normalize_query
+from app.services.upstream import MusicProvider, SearchError, search_provider
+
+SEARCH_DEADLINE_MS = int(os.getenv("SEARCH_DEADLINE_MS", "1500"))
+
+
+def track_key(track: dict) -> tuple[str, str]:
+    return normalize_query(track.get("artist_name") or ""), normalize_query(track.get("name") or "")
+
+
+class TrackMerger:
+    """Collects tracks from several providers, keeping the first of each artist/title."""
+
+    def __init__(self):
+        self.seen: set[tuple[str, str]] = set()
+        self.tracks: list[dict] = []
+
+    def add(self, provider: str, tracks: list[dict]) -> list[dict]:
+        added = []
+        for track in tracks:
+            key = track_key(track)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            # Cached results are shared, so tag a copy
+            added.append({**track, "provider": provider})
+        self.tracks.extend(added)
+        return added
+
+
+async def provider_results(providers: list[MusicProvider], query: str,
+                           deadline_ms: int = SEARCH_DEADLINE_MS) -> AsyncIterator[tuple[str, dict, list[dict]]]:
+    """Search all providers concurrently, yielding (provider, status, tracks) as each finishes.
+
+    Providers still running when the deadline passes are reported with a
+    "timeout" status; their upstream requests keep running so the result
+    cache is filled for the next search.
+    """
+    started = time.perf_counter()
+    deadline = started + deadline_ms / 1000
+    tasks = {asyncio.ensure_future(search_provider(provider, query)): provider.name for provider in providers}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(deadline - time.perf_counter(), 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            for task in sorted(done, key=lambda task: list(tasks).index(task)):
+                name = tasks[task]
+                if task.exception() is not None:
+                    error = task.exception()
+                    message = str(error) if isinstance(error, SearchError) else f"{type(error).__name__}: {error}"
+                    yield name, {"status": "error", "error": message, "elapsed_ms": elapsed_ms}, []
+                else:
+                    tracks = task.result() or []
+                    yield name, {"status": "ok", "count": len(tracks), "elapsed_ms": elapsed_ms}, tracks
+        for task in sorted(pending, key=lambda task: list(tasks).index(task)):
+            yield tasks[task], {"status": "timeout", "elapsed_ms": deadline_ms}, []
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def federated_search(providers: list[MusicProvider], query: str, deadline_ms: int = SEARCH_DEADLINE_MS) -> dict:
+    results = {}
+    async for name, status, tracks in provider_results(providers, query, deadline_ms):
+        results[name] = (status, tracks)
+
+    # Merge in provider order so the response does not depend on who answered first
+    merger = TrackMerger()
+    for provider in providers:
+        status, tracks = results[provider.name]
+        merger.add(provider.name, tracks)
+    return {
+        "provider": "all",
+        "tracks": merger.tracks,
+        "providers": {provider.name: results[provider.name][0] for provider in providers},
+    }
+
+
+async def stream_federated_search(providers: list[MusicProvider], query: str,
+                                  deadline_ms: int = SEARCH_DEADLINE_MS) -> AsyncIterator[dict]:
+    """Yield one message per provider as it finishes, then a summary."""
+    merger = TrackMerger()
+    statuses = {}
+    async for name, status, tracks in provider_results(providers, query, deadline_ms):
+        statuses[name] = status
+        yield {"type": "results", "provider": name, **status, "tracks": merger.add(name, tracks)}
+    yield {"type": "done", "total": len(merger.tracks), "providers": statuses}
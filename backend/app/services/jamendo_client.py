@@ -1,8 +1,8 @@
 import logging
 import os
-import requests
-import json
+import httpx
 from dotenv import load_dotenv
+from app.services.upstream import MusicProvider, UpstreamClient
 
 load_dotenv()
 
@@ -16,13 +16,22 @@ if JAMENDO_CLIENT_ID:
 else:
     logger.error("Jamendo Client ID is not set for client.")
 
-class JamendoClient:
-    def __init__(self, client_id: str):
+class JamendoClient(MusicProvider):
+    name = "jamendo"
+
+    def __init__(self, client_id: str, transport: httpx.AsyncBaseTransport | None = None):
         if not client_id:
             raise ValueError("Jamendo client ID is required.")
         self.client_id = client_id
+        self.http = UpstreamClient(BASE_URL, transport=transport)
+
+    async def start(self):
+        await self.http.start()
+
+    async def close(self):
+        await self.http.close()
 
-    def search_tracks(self, query: str, limit: int = 20):
+    async def search_tracks(self, query: str, limit: int = 20):
         endpoint = "tracks/"
         params = {
             "client_id": self.client_id,
@@ -33,20 +42,12 @@ class JamendoClient:
         }
         
         logger.info(f"Searching Jamendo with query: {query}")
-        logger.info(f"Request params: {params}")
 
         try:
-            response = requests.get(f"{BASE_URL}{endpoint}", params=params)
-            logger.info(f"Jamendo API response status code: {response.status_code}")
-            response.raise_for_status()
-
             try:
-                data = response.json()
-                logger.info("Successfully decoded JSON from Jamendo API response.")
-                # logger.debug(f"Jamendo API response data: {data}")
-            except json.JSONDecodeError:
+                data = await self.http.get_json(endpoint, params=params)
+            except ValueError:
                 logger.error("Failed to decode JSON from Jamendo API response.")
-                logger.error(f"Response text: {response.text}")
                 return None, "Failed to decode response from Jamendo API."
 
             if data.get("headers", {}).get("status") == "success":
@@ -67,8 +68,9 @@ class JamendoClient:
                 logger.error(f"Jamendo API error: {error_message}")
                 return None, f"Jamendo API error: {error_message}"
 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Failed to connect to Jamendo API: {e}")
             return None, f"Failed to connect to Jamendo API: {e}"
 
 jamendo_client = JamendoClient(client_id=JAMENDO_CLIENT_ID)
+
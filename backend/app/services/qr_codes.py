@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import qrcode
+import qrcode.image.svg
+
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "512"))
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def render_qr(data: str, image_format: str = "png") -> bytes:
+    if image_format == "svg":
+        return qrcode.make(data, image_factory=qrcode.image.svg.SvgPathImage, box_size=10, border=4).to_string()
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class QrCodeCache:
+    """Rendered session QR codes, least recently used evicted first.
+
+    A session's QR code never changes, so entries do not expire and carry
+    a strong ETag derived from the image bytes. Rendering runs in a small
+    thread pool to keep the event loop free.
+    """
+
+    def __init__(self, max_entries: int = QR_CACHE_SIZE, workers: int = QR_WORKERS):
+        self.max_entries = max_entries
+        self.workers = workers
+        self._entries: OrderedDict[tuple[str, str], tuple[str, bytes]] = OrderedDict()
+        self._executor: ThreadPoolExecutor | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, session_code: str, image_format: str) -> tuple[str, bytes] | None:
+        entry = self._entries.get((session_code, image_format))
+        if entry is not None:
+            self._entries.move_to_end((session_code, image_format))
+            self.hits += 1
+        return entry
+
+    async def render(self, session_code: str, image_format: str) -> tuple[str, bytes]:
+        """Return (etag, image) for a session, rendering it on a miss."""
+        entry = self.peek(session_code, image_format)
+        if entry is not None:
+            return entry
+        self.misses += 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr")
+        image = await asyncio.get_running_loop().run_in_executor(self._executor, render_qr, session_code, image_format)
+        entry = (f'"{hashlib.sha256(image).hexdigest()[:32]}"', image)
+        self._entries[(session_code, image_format)] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+qr_codes = QrCodeCache()
@@ -0,0 +1,240 @@
+import os
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.queue import Queue
+from app.services.session_cache import session_cache
+from app.services.vote_buffer import vote_buffer
+
+# Sessions whose queue is kept in memory per worker, least recently used evicted first
+QUEUE_INDEX_SESSIONS = int(os.getenv("QUEUE_INDEX_SESSIONS", "1024"))
+
+
+@dataclass
+class QueueEntry:
+    """In-memory copy of an unplayed queue row.
+
+    Attribute names mirror the `Queue` columns so entries can be used
+    wherever a loaded row is expected (e.g. `song_response`).
+    """
+    id: int
+    song_id: str
+    session_code: str
+    song_title: str
+    artist_name: str | None
+    song_url: str
+    image: str
+    added_by: str
+    votes: int = 0
+    position: int = 0
+    played: bool = False
+
+    @classmethod
+    def from_model(cls, item: Queue) -> "QueueEntry":
+        return cls(
+            id=item.id,
+            song_id=item.song_id,
+            session_code=item.session_code,
+            song_title=item.song_title,
+            artist_name=item.artist_name,
+            song_url=item.song_url,
+            image=item.image,
+            added_by=item.added_by,
+            votes=item.votes or 0,
+            position=item.position or 0,
+            played=bool(item.played),
+        )
+
+    @property
+    def vote_key(self) -> tuple[int, int]:
+        return (-self.votes, self.id)
+
+    @property
+    def position_key(self) -> tuple[int, int]:
+        return (self.position, self.id)
+
+    def to_dict(self):
+        return Queue.to_dict(self)
+
+
+class SessionQueueIndex:
+    """Ranked view of one session's unplayed queue.
+
+    Two sorted key lists are kept side by side: one by (-votes, id) for
+    smart sort and one by (position, id) for manual sort, so switching
+    between them only flips `manual_sort`.
+    """
+
+    def __init__(self, entries: list[QueueEntry] = (), manual_sort: bool = False):
+        self.manual_sort = manual_sort
+        self.entries: dict[int, QueueEntry] = {entry.id: entry for entry in entries}
+        self._by_votes = sorted(entry.vote_key for entry in self.entries.values())
+        self._by_position = sorted(entry.position_key for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, queue_id: int):
+        return queue_id in self.entries
+
+    @staticmethod
+    def _discard(keys: list, key: tuple[int, int]):
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    def add(self, entry: QueueEntry):
+        if entry.id in self.entries:
+            self.remove(entry.id)
+        self.entries[entry.id] = entry
+        insort(self._by_votes, entry.vote_key)
+        insort(self._by_position, entry.position_key)
+
+    def remove(self, queue_id: int) -> QueueEntry | None:
+        entry = self.entries.pop(queue_id, None)
+        if entry is not None:
+            self._discard(self._by_votes, entry.vote_key)
+            self._discard(self._by_position, entry.position_key)
+        return entry
+
+    def update_votes(self, queue_id: int, votes: int):
+        entry = self.entries.get(queue_id)
+        if entry is None or entry.votes == votes:
+            return
+        self._discard(self._by_votes, entry.vote_key)
+        entry.votes = votes
+        insort(self._by_votes, entry.vote_key)
+
+    def set_positions(self, positions: dict[int, int]):
+        if len(positions) == 1:
+            # A single move: re-slot one key instead of re-sorting
+            (queue_id, position), = positions.items()
+            entry = self.entries.get(queue_id)
+            if entry is not None:
+                self._discard(self._by_position, entry.position_key)
+                entry.position = position
+                insort(self._by_position, entry.position_key)
+            return
+        for queue_id, position in positions.items():
+            entry = self.entries.get(queue_id)
+            if entry is not None:
+                entry.position = position
+        self._by_position = sorted(entry.position_key for entry in self.entries.values())
+
+    def by_position(self) -> list[QueueEntry]:
+        return [self.entries[queue_id] for _, queue_id in self._by_position]
+
+    def ranked(self, limit: int | None = None) -> list[QueueEntry]:
+        keys = self._by_position if self.manual_sort else self._by_votes
+        if limit is not None:
+            keys = keys[:limit]
+        return [self.entries[queue_id] for _, queue_id in keys]
+
+    def ranked_after(self, key: tuple[int, int], limit: int, manual_sort: bool | None = None) -> list[QueueEntry]:
+        """Entries ranked strictly after `key` (a vote or position key)."""
+        manual_sort = self.manual_sort if manual_sort is None else manual_sort
+        keys = self._by_position if manual_sort else self._by_votes
+        start = bisect_right(keys, tuple(key))
+        return [self.entries[queue_id] for _, queue_id in keys[start:start + limit]]
+
+    def top(self) -> QueueEntry | None:
+        keys = self._by_position if self.manual_sort else self._by_votes
+        if not keys:
+            return None
+        return self.entries[keys[0][1]]
+
+
+class QueueIndexRegistry:
+    """Per-process registry of session queue indexes.
+
+    Indexes are built lazily from the `queue` table on first read and are
+    then kept current by the queue routes after each commit, through
+    `for_update`. Mutations for sessions that have not been loaded are
+    ignored; the next read rebuilds them from the database.
+
+    Each session has a generation that `for_update` and `invalidate` bump.
+    A load that overlapped a bump may have read rows from before the
+    write, so it is retried instead of being kept.
+
+    At most `max_sessions` indexes (and generations) are kept, least
+    recently used evicted first. Forgetting a generation bumps the epoch
+    shared by all sessions, so a load in flight cannot mistake the reset
+    counter for an unchanged one.
+    """
+
+    load_attempts = 3
+
+    def __init__(self, max_sessions: int = QUEUE_INDEX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, SessionQueueIndex] = OrderedDict()
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._epoch = 0
+
+    async def get(self, db: AsyncSession, session_code: str) -> SessionQueueIndex:
+        index = self._sessions.get(session_code)
+        if index is not None:
+            self._sessions.move_to_end(session_code)
+            return index
+        for _ in range(self.load_attempts):
+            generation = self._generation(session_code)
+            index = await self._load(db, session_code)
+            if self._generation(session_code) == generation:
+                # Another request may have loaded (and updated) it meanwhile
+                return self._keep(session_code, index)
+        # Still being written to: serve this read without keeping the index
+        return index
+
+    def peek(self, session_code: str) -> SessionQueueIndex | None:
+        return self._sessions.get(session_code)
+
+    def for_update(self, session_code: str) -> SessionQueueIndex | None:
+        """The loaded index of a session whose queue was just written, if any.
+
+        Call after the commit, even when nothing will be applied: it marks
+        loads still in flight as stale.
+        """
+        self._bump(session_code)
+        return self._sessions.get(session_code)
+
+    def invalidate(self, session_code: str | None = None):
+        if session_code is None:
+            self._sessions.clear()
+            self._epoch += 1
+        else:
+            self._sessions.pop(session_code, None)
+            self._bump(session_code)
+
+    def _generation(self, session_code: str) -> tuple[int, int]:
+        return self._epoch, self._generations.get(session_code, 0)
+
+    def _bump(self, session_code: str):
+        self._generations[session_code] = self._generations.get(session_code, 0) + 1
+        self._generations.move_to_end(session_code)
+        if len(self._generations) > self.max_sessions:
+            self._generations.popitem(last=False)
+            self._epoch += 1
+
+    def _keep(self, session_code: str, index: SessionQueueIndex) -> SessionQueueIndex:
+        index = self._sessions.setdefault(session_code, index)
+        self._sessions.move_to_end(session_code)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return index
+
+    async def _load(self, db: AsyncSession, session_code: str) -> SessionQueueIndex:
+        info = await session_cache.get(db, session_code)
+        items = (await db.execute(select(Queue).filter(
+            Queue.session_code == session_code,
+            Queue.played == False,
+            Queue.song_url.isnot(None)
+        ))).scalars().all()
+        entries = [QueueEntry.from_model(item) for item in items]
+        for entry in entries:
+            # Votes that have not been flushed yet (write-behind mode)
+            entry.votes = vote_buffer.tally(entry.id, entry.votes)
+        return SessionQueueIndex(entries, info is not None and info.manual_sort)
+
+
+queue_index = QueueIndexRegistry()
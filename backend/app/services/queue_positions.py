@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import AsyncSessionLocal
+from app.models.queue import Queue
+from app.models.session import Session as SessionModel
+from app.services.queue_index import QUEUE_INDEX_SESSIONS, queue_index
+
+logger = logging.getLogger(__name__)
+
+# Gap left between neighbouring positions, so a move can land between two
+# songs without renumbering the others
+QUEUE_POSITION_STEP = int(os.getenv("QUEUE_POSITION_STEP", "1024"))
+# A move that leaves a smaller gap schedules a background rebalance
+QUEUE_REBALANCE_MIN_GAP = int(os.getenv("QUEUE_REBALANCE_MIN_GAP", "4"))
+
+
+def spaced_positions(order: list[int], step: int = QUEUE_POSITION_STEP) -> dict[int, int]:
+    return {queue_id: n * step for n, queue_id in enumerate(order, 1)}
+
+
+def position_between(before: int | None, after: int | None, step: int = QUEUE_POSITION_STEP) -> int | None:
+    """A position strictly between two neighbours (None for an open end), or None if there is no room."""
+    if before is None and after is None:
+        return step
+    if before is None:
+        return after - step
+    if after is None:
+        return before + step
+    if after - before < 2:
+        return None
+    return (before + after) // 2
+
+
+async def bulk_set_positions(db: AsyncSession, session_code: str, positions: dict[int, int]):
+    """Write many queue positions with a single UPDATE ... CASE statement."""
+    if not positions:
+        return
+    await db.execute(update(Queue)
+                     .where(Queue.session_code == session_code, Queue.id.in_(positions))
+                     .values(position=case(positions, value=Queue.id, else_=Queue.position)))
+
+
+async def claim_session_queue(db: AsyncSession, session_code: str, **values) -> bool:
+    """Lock a session's queue positions for the rest of the transaction; False if the session is unknown.
+
+    The session row is updated first (with `values`, or left as it is),
+    which row-locks it on PostgreSQL and takes the write lock on SQLite.
+    Moves, reorders and rebalances of a session then run one at a time
+    across workers, and positions they read afterwards are current.
+    """
+    result = await db.execute(update(SessionModel)
+                              .where(SessionModel.session_code == session_code)
+                              .values(**(values or {"manual_sort": SessionModel.manual_sort})))
+    return result.rowcount > 0
+
+
+async def neighbour_positions(db: AsyncSession, session_code: str, queue_id: int,
+                              after_id: int | None) -> tuple[int | None, int | None] | None:
+    """Positions a song moved after `after_id` lands between (None for an open end).
+
+    Read from the database, not the index, which may lag behind another
+    worker's rebalance. Returns None if `after_id` is not in the queue.
+    """
+    unplayed = select(Queue.id, Queue.position).where(
+        Queue.session_code == session_code,
+        Queue.played == False,
+        Queue.id != queue_id
+    )
+    before = None
+    if after_id is not None:
+        row = (await db.execute(unplayed.where(Queue.id == after_id))).first()
+        if row is None:
+            return None
+        before = row.position
+        unplayed = unplayed.where(or_(Queue.position > row.position,
+                                      and_(Queue.position == row.position, Queue.id > row.id)))
+    after = (await db.execute(unplayed.order_by(Queue.position, Queue.id).limit(1))).first()
+    return before, after.position if after is not None else None
+
+
+class PositionCounter:
+    """Hands out positions at the end of each session's queue.
+
+    The highest position is read from the database once per session and
+    then advanced in memory, so adding songs needs no max() scan. Moves
+    and rebalances report the positions they write with `observe`, and
+    `invalidate` forgets a session whose queue another worker changed.
+    Up to `max_sessions` sessions are kept, least recently used first out.
+    """
+
+    def __init__(self, step: int = QUEUE_POSITION_STEP, max_sessions: int = QUEUE_INDEX_SESSIONS):
+        self.step = step
+        self.max_sessions = max_sessions
+        self._last: OrderedDict[str, int] = OrderedDict()
+
+    async def reserve(self, db: AsyncSession, session_code: str, count: int = 1) -> list[int]:
+        if session_code not in self._last:
+            last = (await db.execute(select(func.max(Queue.position)).filter(Queue.session_code == session_code))).scalar() or 0
+            # Another request may have loaded (and advanced) it meanwhile
+            self._last.setdefault(session_code, last)
+            while len(self._last) > self.max_sessions:
+                self._last.popitem(last=False)
+        self._last.move_to_end(session_code)
+        first = self._last[session_code] + self.step
+        self._last[session_code] += count * self.step
+        return list(range(first, self._last[session_code] + 1, self.step))
+
+    def observe(self, session_code: str, *positions: int):
+        if session_code in self._last:
+            self._last[session_code] = max(self._last[session_code], *positions)
+
+    def invalidate(self, session_code: str | None = None):
+        if session_code is None:
+            self._last.clear()
+        else:
+            self._last.pop(session_code, None)
+
+
+position_counter = PositionCounter()
+
+
+class QueueRebalancer:
+    """Respaces a session's queue positions once moves have used up the gaps.
+
+    `/queue/move` only rewrites the moved row, halving the gap it lands
+    in. When a gap gets small a rebalance is scheduled in the background;
+    it renumbers the unplayed queue in its current order with one bulk
+    UPDATE and broadcasts the order, so other workers drop their copy.
+    Moves, reorders and rebalances of a session are serialized by a
+    per-session lock in this process and by `claim_session_queue` across
+    workers.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, step: int = QUEUE_POSITION_STEP,
+                 min_gap: int = QUEUE_REBALANCE_MIN_GAP):
+        self.session_factory = session_factory
+        self.step = step
+        self.min_gap = min_gap
+        # Per-session lock and the number of tasks holding or awaiting it
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.rebalances = 0
+
+    @asynccontextmanager
+    async def lock(self, session_code: str):
+        lock, users = self._locks.get(session_code, (asyncio.Lock(), 0))
+        self._locks[session_code] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session_code]
+            # Dropped once nobody holds or waits for it
+            if users == 1:
+                del self._locks[session_code]
+            else:
+                self._locks[session_code] = (lock, users - 1)
+
+    async def rebalance(self, db: AsyncSession, session_code: str) -> dict[int, int]:
+        """Renumber the unplayed queue; the caller holds the session lock and commits."""
+        order = (await db.execute(select(Queue.id).filter(
+            Queue.session_code == session_code,
+            Queue.played == False
+        ).order_by(Queue.position, Queue.id))).scalars().all()
+        positions = spaced_positions(order, self.step)
+        await bulk_set_positions(db, session_code, positions)
+        if positions:
+            position_counter.observe(session_code, *positions.values())
+        self.rebalances += 1
+        return positions
+
+    def needs_rebalance(self, before: int | None, position: int, after: int | None) -> bool:
+        gaps = [position - before if before is not None else self.step, after - position if after is not None else self.step]
+        return min(gaps) < self.min_gap
+
+    def schedule(self, session_code: str):
+        if session_code not in self._tasks:
+            self._tasks[session_code] = asyncio.create_task(self._run(session_code))
+
+    async def _run(self, session_code: str):
+        # Imported here: the WebSocket manager itself depends on this module
+        from app.core.websocket import broadcast_queue_patch
+        try:
+            async with self.lock(session_code):
+                async with self.session_factory() as db:
+                    if not await claim_session_queue(db, session_code):
+                        return
+                    positions = await self.rebalance(db, session_code)
+                    await db.commit()
+                index = queue_index.for_update(session_code)
+                if index is not None:
+                    index.set_positions(positions)
+            await broadcast_queue_patch(session_code, {
+                "type": "queue_reordered",
+                "action": "rebalanced",
+                "order": list(positions)
+            })
+        except Exception as e:
+            logger.error(f"Failed to rebalance queue positions of {session_code}: {e}")
+        finally:
+            self._tasks.pop(session_code, None)
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+queue_rebalancer = QueueRebalancer()
@@ -0,0 +1,143 @@
+import base64
+import json
+import os
+import secrets
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.queue import UserVote, SongResponse
+from app.services.queue_index import queue_index, QueueEntry
+from app.services.vote_buffer import vote_buffer
+
+QUEUE_CURSOR_SNAPSHOTS = int(os.getenv("QUEUE_CURSOR_SNAPSHOTS", "256"))
+
+
+async def user_votes(db: AsyncSession, user_id: str) -> dict[int, bool]:
+    rows = (await db.execute(select(UserVote.queue_id, UserVote.vote_type).filter(UserVote.user_id == user_id))).all()
+    return {queue_id: vote_type for queue_id, vote_type in rows}
+
+
+async def ranked_queue(db: AsyncSession, session_code: str, user_id: str | None = None, limit: int | None = None):
+    """Return the unplayed queue of a session as (entry, user_vote_type) pairs.
+
+    Ordering comes from the in-memory queue index, which follows the
+    session's `manual_sort` flag. The caller's votes are loaded with a
+    single query, so the read cost does not grow with the queue length.
+    """
+    entries = (await queue_index.get(db, session_code)).ranked(limit)
+    votes = await user_votes(db, user_id) if user_id is not None and entries else {}
+    return [(entry, vote_buffer.user_vote(entry.id, user_id, votes.get(entry.id))) for entry in entries]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(data["o"], int) or data["o"] < 0 or not isinstance(data["m"], bool) \
+                or len(data["k"]) != 2 or not all(isinstance(value, int) for value in data["k"]):
+            raise ValueError
+        return data
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+class QueueSnapshots:
+    """Ranked orders captured when a client starts paging through a queue.
+
+    Later pages follow the captured order, so songs that move up or down
+    with votes while the client is paging are neither repeated nor
+    skipped; played songs are left out. A cursor also carries the ranking
+    key of its last song, so a worker that does not hold the snapshot
+    (or has evicted it) continues from that key in the current order.
+    """
+
+    def __init__(self, max_entries: int = QUEUE_CURSOR_SNAPSHOTS):
+        self.max_entries = max_entries
+        self._snapshots: OrderedDict[str, tuple[str, list[int]]] = OrderedDict()
+
+    def take(self, session_code: str, ids: list[int]) -> str:
+        snapshot_id = secrets.token_urlsafe(8)
+        self._snapshots[snapshot_id] = (session_code, ids)
+        while len(self._snapshots) > self.max_entries:
+            self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def get(self, snapshot_id: str, session_code: str) -> list[int] | None:
+        snapshot = self._snapshots.get(snapshot_id)
+        if snapshot is None or snapshot[0] != session_code:
+            return None
+        self._snapshots.move_to_end(snapshot_id)
+        return snapshot[1]
+
+    def clear(self):
+        self._snapshots.clear()
+
+
+queue_snapshots = QueueSnapshots()
+
+
+def _sort_key(entry: QueueEntry, manual_sort: bool) -> list[int]:
+    return list(entry.position_key if manual_sort else entry.vote_key)
+
+
+async def ranked_page(db: AsyncSession, session_code: str, user_id: str | None, limit: int, cursor: str | None = None):
+    """One page of the ranked queue as (entries, next_cursor); next_cursor is None on the last page."""
+    index = await queue_index.get(db, session_code)
+    if cursor is None:
+        manual_sort = index.manual_sort
+        order = [entry.id for entry in index.ranked()]
+        snapshot_id, offset = queue_snapshots.take(session_code, order), 0
+    else:
+        data = decode_cursor(cursor)
+        snapshot_id, offset, manual_sort = data.get("s"), data["o"], data["m"]
+        order = queue_snapshots.get(snapshot_id, session_code) if snapshot_id else None
+
+    if order is not None:
+        entries = []
+        while offset < len(order) and len(entries) < limit:
+            entry = index.entries.get(order[offset])
+            offset += 1
+            if entry is not None:
+                entries.append(entry)
+        more = any(queue_id in index for queue_id in order[offset:])
+    else:
+        entries = index.ranked_after(data["k"], limit + 1, manual_sort)
+        more = len(entries) > limit
+        entries = entries[:limit]
+        snapshot_id, offset = None, offset + len(entries)
+
+    next_cursor = None
+    if more and entries:
+        next_cursor = encode_cursor({"s": snapshot_id, "o": offset, "m": manual_sort, "k": _sort_key(entries[-1], manual_sort)})
+    votes = await user_votes(db, user_id) if user_id is not None and entries else {}
+    return [(entry, vote_buffer.user_vote(entry.id, user_id, votes.get(entry.id))) for entry in entries], next_cursor
+
+
+async def ranked_window(db: AsyncSession, session_code: str, user_id: str, top: int):
+    """The top `top` songs plus the caller's own additions further down, as (rank, entry, user_vote_type)."""
+    ranked = (await queue_index.get(db, session_code)).ranked()
+    window = [(rank, entry) for rank, entry in enumerate(ranked, 1) if rank <= top or entry.added_by == user_id]
+    votes = await user_votes(db, user_id) if window else {}
+    return [(rank, entry, vote_buffer.user_vote(entry.id, user_id, votes.get(entry.id))) for rank, entry in window]
+
+
+def song_response(item, user_vote_type: bool | None = None, rank: int | None = None) -> SongResponse:
+    return SongResponse(
+        id=item.id,
+        song_id=item.song_id,
+        name=item.song_title,
+        artist_name=item.artist_name,
+        audio=item.song_url,
+        image=item.image,
+        added_by=item.added_by,
+        votes=item.votes,
+        user_vote_type=user_vote_type,
+        rank=rank
+    )
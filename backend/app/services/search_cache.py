@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL_S = float(os.getenv("SEARCH_CACHE_TTL_S", "300"))
+SEARCH_CACHE_STALE_S = float(os.getenv("SEARCH_CACHE_STALE_S", "3600"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class SearchCache:
+    """Bounded cache of provider search results.
+
+    Entries are keyed by (provider, normalized query) and evicted least
+    recently used first. A result is fresh for `ttl` seconds; for
+    `stale_ttl` seconds after that it is still served while one background
+    request refreshes it. Concurrent misses for the same key share a single
+    upstream request. Failed loads are not cached.
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL_S,
+                 stale_ttl: float = SEARCH_CACHE_STALE_S, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._entries: OrderedDict[tuple[str, str], tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.evictions = 0
+
+    async def get(self, provider: str, query: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        key = (provider, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = self.clock() - stored_at
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                if age < self.ttl:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        self.refreshes += 1
+                        self._start(key, loader).add_done_callback(self._refresh_done)
+                return value
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._start(key, loader)
+        else:
+            self.coalesced += 1
+        # A caller that goes away must not cancel the request for the others
+        return await asyncio.shield(task)
+
+    def _start(self, key: tuple[str, str], loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._inflight[key] = task
+        return task
+
+    async def _load(self, key: tuple[str, str], loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+        except BaseException:
+            self.errors += 1
+            self._inflight.pop(key, None)
+            raise
+        self._store(key, value)
+        self._inflight.pop(key, None)
+        return value
+
+    def _store(self, key: tuple[str, str], value: Any):
+        self._entries[key] = (self.clock(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _refresh_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Search cache refresh failed: {task.exception()}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.stale_hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+search_cache = SearchCache()
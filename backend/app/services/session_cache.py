@@ -0,0 +1,85 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.session import Session as SessionModel
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "4096"))
+
+
+@dataclass
+class SessionInfo:
+    session_code: str
+    host_id: str
+    name: str | None
+    duration: str | None
+    manual_sort: bool
+
+    @classmethod
+    def from_model(cls, session: SessionModel) -> "SessionInfo":
+        return cls(
+            session_code=session.session_code,
+            host_id=session.host_id,
+            name=session.name,
+            duration=session.duration,
+            manual_sort=bool(session.manual_sort),
+        )
+
+
+class SessionCache:
+    """Per-process cache of session metadata, least recently used evicted first.
+
+    Routes that only need to know a session exists, or read its
+    `manual_sort` flag, look it up here instead of querying `sessions`.
+    Writes go to the database first and then through to the cache
+    (`put`, `set_manual_sort`). Other workers learn about a change from the
+    `queue_reordered` event relayed by the backplane, which drops their
+    entry. Unknown session codes are not cached.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, SessionInfo] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db: AsyncSession, session_code: str) -> SessionInfo | None:
+        info = self._entries.get(session_code)
+        if info is not None:
+            self._entries.move_to_end(session_code)
+            self.hits += 1
+            return info
+        self.misses += 1
+        session = (await db.execute(select(SessionModel).filter(SessionModel.session_code == session_code))).scalar_one_or_none()
+        if session is None:
+            return None
+        # Another request may have written through meanwhile
+        return self._entries.get(session_code) or self.put(SessionInfo.from_model(session))
+
+    def peek(self, session_code: str) -> SessionInfo | None:
+        return self._entries.get(session_code)
+
+    def put(self, info: SessionInfo) -> SessionInfo:
+        self._entries[info.session_code] = info
+        self._entries.move_to_end(info.session_code)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return info
+
+    def set_manual_sort(self, session_code: str, manual_sort: bool):
+        info = self._entries.get(session_code)
+        if info is not None:
+            info.manual_sort = manual_sort
+
+    def invalidate(self, session_code: str | None = None):
+        if session_code is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(session_code, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+session_cache = SessionCache()
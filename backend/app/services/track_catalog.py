@@ -0,0 +1,174 @@
+import heapq
+from bisect import bisect_left, insort
+import os
+import re
+from dataclasses import dataclass
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.queue import Queue
+
+CATALOG_MAX_TRACKS = int(os.getenv("CATALOG_MAX_TRACKS", "50000"))
+
+# Longest token prefix kept in the index; longer query terms are checked per track
+MAX_PREFIX = 12
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokens(text: str) -> list[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+@dataclass
+class CatalogTrack:
+    id: str
+    name: str
+    artist_name: str | None
+    audio: str
+    image: str | None
+    queued: int = 0
+    upvotes: int = 0
+
+    @property
+    def score(self) -> int:
+        return self.queued + self.upvotes
+
+    @property
+    def rank_key(self) -> tuple[int, str, str]:
+        return (-self.score, self.name.casefold(), self.id)
+
+    @property
+    def tokens(self) -> list[str]:
+        return tokens(f"{self.name} {self.artist_name or ''}")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "artist_name": self.artist_name,
+            "audio": self.audio,
+            "image": self.image,
+            "queued": self.queued,
+            "upvotes": self.upvotes,
+        }
+
+
+class TrackCatalog:
+    """In-memory catalog of known tracks for instant autocomplete.
+
+    Every word of a track's title and artist is indexed by its prefixes, so
+    a suggestion is a set intersection over the query words followed by a
+    top-k by popularity (times queued plus upvotes, across all sessions).
+    All tracks are also kept in popularity order; when a short prefix
+    matches a large share of the catalog, walking that order finds the
+    top-k sooner than ranking every match.
+    The catalog is seeded from the queue table at startup and then learns
+    from songs added to queues, upvotes and provider search results.
+    """
+
+    def __init__(self, max_tracks: int = CATALOG_MAX_TRACKS):
+        self.max_tracks = max_tracks
+        self.tracks: dict[str, CatalogTrack] = {}
+        self._prefixes: dict[str, set[str]] = {}
+        self._order: list[tuple[int, str, str]] = []
+        self._rank: dict[str, tuple[int, str, str]] = {}
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _add(self, track: dict) -> CatalogTrack | None:
+        track_id = str(track.get("id") or "")
+        if not track_id or not track.get("name") or not track.get("audio"):
+            return None
+        entry = self.tracks.get(track_id)
+        if entry is None:
+            entry = CatalogTrack(
+                id=track_id,
+                name=track["name"],
+                artist_name=track.get("artist_name"),
+                audio=track["audio"],
+                image=track.get("image"),
+            )
+            self.tracks[track_id] = entry
+            self._rank[track_id] = entry.rank_key
+            insort(self._order, self._rank[track_id])
+            for token in set(entry.tokens):
+                for length in range(1, min(len(token), MAX_PREFIX) + 1):
+                    self._prefixes.setdefault(token[:length], set()).add(track_id)
+        return entry
+
+    def _bump(self, entry: CatalogTrack, queued: int = 0, upvotes: int = 0):
+        del self._order[bisect_left(self._order, self._rank[entry.id])]
+        entry.queued += queued
+        entry.upvotes += upvotes
+        self._rank[entry.id] = entry.rank_key
+        insort(self._order, self._rank[entry.id])
+
+    def record_queued(self, track: dict, times: int = 1, upvotes: int = 0):
+        entry = self._add(track)
+        if entry is not None:
+            self._bump(entry, queued=times, upvotes=upvotes)
+
+    def record_upvote(self, track_id: str, change: int = 1):
+        """Count an upvote of a track, or take one back (negative change) when it is revoked."""
+        entry = self.tracks.get(str(track_id))
+        if entry is not None and change:
+            self._bump(entry, upvotes=max(change, -entry.upvotes))
+
+    def record_results(self, tracks: list[dict]):
+        # Search results only fill free space; queued tracks are always kept
+        for track in tracks:
+            if len(self.tracks) >= self.max_tracks:
+                break
+            self._add(track)
+
+    def suggest(self, query: str, limit: int = 8) -> list[CatalogTrack]:
+        terms = tokens(query)
+        if not terms:
+            return []
+        matches = sorted((self._prefixes.get(term[:MAX_PREFIX], set()) for term in terms), key=len)
+        candidates = matches[0].intersection(*matches[1:]) if len(matches) > 1 else matches[0]
+        long_terms = [term for term in terms if len(term) > MAX_PREFIX]
+        if long_terms:
+            candidates = {
+                track_id for track_id in candidates
+                if all(any(token.startswith(term) for token in self.tracks[track_id].tokens) for term in long_terms)
+            }
+
+        if len(candidates) * 32 > len(self.tracks):
+            # Matches are common: the most popular ones are found within the
+            # first few hundred tracks of the popularity order
+            found = []
+            for _, _, track_id in self._order:
+                if track_id in candidates:
+                    found.append(self.tracks[track_id])
+                    if len(found) == limit:
+                        break
+            return found
+        return [self.tracks[track_id] for _, _, track_id in heapq.nsmallest(limit, map(self._rank.__getitem__, candidates))]
+
+    def clear(self):
+        self.tracks.clear()
+        self._prefixes.clear()
+        self._order.clear()
+        self._rank.clear()
+
+    async def load(self, db: AsyncSession):
+        """Seed the catalog with the most queued songs of all sessions."""
+        self.clear()
+        queued = func.count(Queue.id)
+        rows = (await db.execute(
+            select(
+                Queue.song_id, func.max(Queue.song_title), func.max(Queue.artist_name),
+                func.max(Queue.song_url), func.max(Queue.image), queued,
+                func.sum(case((Queue.votes > 0, Queue.votes), else_=0))
+            ).group_by(Queue.song_id).order_by(queued.desc()).limit(self.max_tracks)
+        )).all()
+        for song_id, name, artist_name, audio, image, times, upvotes in rows:
+            self.record_queued(
+                {"id": song_id, "name": name, "artist_name": artist_name, "audio": audio, "image": image},
+                times=times, upvotes=upvotes or 0
+            )
+
+
+track_catalog = TrackCatalog()
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import os
+import random
+import httpx
+from app.services.search_cache import search_cache, normalize_query
+from app.services.track_catalog import track_catalog
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_TIMEOUT_S = float(os.getenv("UPSTREAM_TIMEOUT_S", "5"))
+UPSTREAM_CONNECT_TIMEOUT_S = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_S", "2"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "16"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_S = float(os.getenv("UPSTREAM_BACKOFF_S", "0.2"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """Pooled async HTTP client for one upstream API.
+
+    Connections are kept alive between requests, every request has a
+    timeout, at most `concurrency` requests are in flight, and connection
+    errors and retryable statuses are retried with exponential backoff.
+    A Retry-After header is honoured up to the request timeout; asking
+    for a longer wait fails the request instead of holding it open.
+    The underlying httpx client is opened by `start()` (or on first use)
+    and released by `close()`.
+    """
+
+    def __init__(self, base_url: str, transport: httpx.AsyncBaseTransport | None = None,
+                 timeout: float = UPSTREAM_TIMEOUT_S, connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT_S,
+                 concurrency: int = UPSTREAM_CONCURRENCY, retries: int = UPSTREAM_RETRIES,
+                 backoff: float = UPSTREAM_BACKOFF_S):
+        self.base_url = base_url
+        self.transport = transport
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retry_after = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client: httpx.AsyncClient | None = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE),
+                transport=self.transport,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _delay(self, attempt: int, response: httpx.Response | None = None) -> float | None:
+        """Seconds to wait before the next attempt, or None if the upstream asks for longer than we wait."""
+        delay = self.backoff * 2 ** attempt * (1 + random.random())
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            if float(retry_after) > self.max_retry_after:
+                return None
+            delay = max(delay, float(retry_after))
+        return min(delay, self.max_retry_after)
+
+    async def get_json(self, path: str, params: dict | None = None):
+        """GET `path` and decode the JSON body; raises httpx.HTTPError or ValueError."""
+        await self.start()
+        for attempt in range(self.retries + 1):
+            async with self._semaphore:
+                try:
+                    response = await self._client.get(path, params=params)
+                except httpx.TransportError as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(f"{self.base_url}{path} failed ({e!r}), retrying")
+                    response = None
+            delay = self._delay(attempt, response)
+            if response is not None:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries or delay is None:
+                    response.raise_for_status()
+                    return response.json()
+                logger.warning(f"{self.base_url}{path} returned {response.status_code}, retrying")
+            await asyncio.sleep(delay)
+
+
+class MusicProvider(ABC):
+    """A searchable source of playable tracks.
+
+    `search_tracks` returns `(tracks, None)` on success and `(None, error)`
+    on failure; tracks are dicts with id, name, artist_name, audio and image.
+    """
+
+    name: str
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def search_tracks(self, query: str, limit: int = 20):
+        ...
+
+
+class SearchError(Exception):
+    pass
+
+
+async def search_provider(provider: MusicProvider, query: str):
+    """Search one provider through the shared result cache; raises SearchError."""
+    async def load():
+        tracks, error = await provider.search_tracks(normalize_query(query))
+        if error:
+            raise SearchError(error)
+        track_catalog.record_results(tracks)
+        return tracks
+
+    return await search_cache.get(provider.name, query, load)
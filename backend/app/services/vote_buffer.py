@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import AsyncSessionLocal
+from app.models.queue import Queue, UserVote
+from app.services.votes import VoteResult, apply_vote, upsert_user_votes
+
+logger = logging.getLogger(__name__)
+
+VOTE_WRITE_BEHIND = os.getenv("VOTE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+VOTE_FLUSH_INTERVAL_MS = int(os.getenv("VOTE_FLUSH_INTERVAL_MS", "200"))
+
+
+class VoteBuffer:
+    """Write-behind buffer for queue votes.
+
+    Votes are applied to an in-memory tally per queue item and returned
+    right away; the accumulated deltas and the users' votes are written
+    in a single transaction every `interval_ms`, and once more on
+    shutdown. Items and user votes are loaded from the database the first
+    time they are voted on. After each flush, items with nothing left to
+    write are dropped once they are played or their session's queue index
+    is no longer loaded; the database is current for them by then.
+
+    Tallies live in this process, so write-behind mode assumes a single
+    worker serves the votes of a session.
+    """
+
+    def __init__(self, enabled: bool = VOTE_WRITE_BEHIND, interval_ms: int = VOTE_FLUSH_INTERVAL_MS,
+                 session_factory=AsyncSessionLocal):
+        self.enabled = enabled
+        self.interval = interval_ms / 1000
+        self.session_factory = session_factory
+        self._tallies: dict[int, tuple[str, str, int]] = {}
+        self._user_votes: dict[int, dict[str, bool | None]] = {}
+        self._deltas: dict[int, int] = {}
+        self._dirty: set[tuple[int, str]] = set()
+        self._retired: set[int] = set()
+        self._evictions = 0
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.flushes = 0
+        self.flushed_votes = 0
+
+    async def vote(self, db: AsyncSession, session_code: str, queue_id: int, user_id: str,
+                   vote_type: bool) -> VoteResult | None:
+        """Apply a vote; returns None if the item is unknown."""
+        evictions = self._evictions
+        tally = self._tallies.get(queue_id)
+        if tally is None:
+            row = (await db.execute(select(Queue.song_id, Queue.votes).filter(
+                Queue.id == queue_id,
+                Queue.session_code == session_code
+            ))).first()
+            if row is None:
+                return None
+            tally = (session_code, row.song_id, row.votes)
+        if tally[0] != session_code:
+            return None
+
+        loaded = None
+        if user_id not in self._user_votes.get(queue_id, {}):
+            loaded = (await db.execute(select(UserVote.vote_type).filter(
+                UserVote.user_id == user_id,
+                UserVote.queue_id == queue_id
+            ))).scalar()
+
+        if self._evictions != evictions:
+            # A flush dropped cached items meanwhile; what we read may predate it
+            return await self.vote(db, session_code, queue_id, user_id, vote_type)
+
+        # No awaits from here on: concurrent votes may have filled the cache meanwhile
+        _, song_id, votes = self._tallies.setdefault(queue_id, tally)
+        users = self._user_votes.setdefault(queue_id, {})
+        previous = users.get(user_id, loaded)
+        delta, user_vote_type = apply_vote(previous, vote_type)
+        users[user_id] = user_vote_type
+        self._tallies[queue_id] = (session_code, song_id, votes + delta)
+        self._deltas[queue_id] = self._deltas.get(queue_id, 0) + delta
+        self._dirty.add((queue_id, user_id))
+        return VoteResult(votes + delta, user_vote_type, song_id, previous)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def tally(self, queue_id: int, default: int) -> int:
+        tally = self._tallies.get(queue_id)
+        return default if tally is None else tally[2]
+
+    def user_vote(self, queue_id: int, user_id: str, default: bool | None) -> bool | None:
+        return self._user_votes.get(queue_id, {}).get(user_id, default)
+
+    def retire(self, queue_id: int):
+        """Forget a played item once its buffered votes are written."""
+        if queue_id in self._tallies:
+            self._retired.add(queue_id)
+
+    async def flush(self) -> int:
+        """Write buffered votes in one transaction; returns the number of user votes written."""
+        async with self._lock:
+            if not self._deltas and not self._dirty:
+                return 0
+            deltas, dirty = self._deltas, self._dirty
+            self._deltas, self._dirty = {}, set()
+            rows = [
+                {"qid": queue_id, "uid": user_id, "vote_type": self._user_votes[queue_id][user_id]}
+                for queue_id, user_id in dirty
+            ]
+            try:
+                await self._write(deltas, rows)
+            except Exception:
+                # Put the batch back; newer votes are already folded into the cache
+                for queue_id, delta in deltas.items():
+                    self._deltas[queue_id] = self._deltas.get(queue_id, 0) + delta
+                self._dirty |= dirty
+                raise
+            self.flushes += 1
+            self.flushed_votes += len(rows)
+            self._evict()
+            return len(rows)
+
+    async def _write(self, deltas: dict[int, int], rows: list[dict]):
+        queue, user_votes = Queue.__table__, UserVote.__table__
+        async with self.session_factory() as db:
+            changed = [{"qid": queue_id, "delta": delta} for queue_id, delta in deltas.items() if delta]
+            if changed:
+                await db.execute(
+                    update(queue).where(queue.c.id == bindparam("qid")).values(votes=queue.c.votes + bindparam("delta")),
+                    changed
+                )
+            revoked = [{"qid": row["qid"], "uid": row["uid"]} for row in rows if row["vote_type"] is None]
+            if revoked:
+                await db.execute(
+                    delete(user_votes).where(user_votes.c.queue_id == bindparam("qid"), user_votes.c.user_id == bindparam("uid")),
+                    revoked
+                )
+            cast = [
+                {"queue_id": row["qid"], "user_id": row["uid"], "vote_type": row["vote_type"]}
+                for row in rows if row["vote_type"] is not None
+            ]
+            if cast:
+                await db.execute(upsert_user_votes(db.bind.dialect.name), cast)
+            await db.commit()
+
+    def _evict(self):
+        # Imported here: the queue index itself reads buffered tallies
+        from app.services.queue_index import queue_index
+
+        pending = set(self._deltas) | {queue_id for queue_id, _ in self._dirty}
+        idle = [
+            queue_id for queue_id, (session_code, _, _) in self._tallies.items()
+            if queue_id not in pending and (queue_id in self._retired or queue_index.peek(session_code) is None)
+        ]
+        for queue_id in idle:
+            self._tallies.pop(queue_id, None)
+            self._user_votes.pop(queue_id, None)
+        if idle:
+            self._evictions += 1
+        self._retired &= pending
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Vote flush failed; retrying on the next tick")
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Final flush so buffered votes survive a restart
+        await self.flush()
+
+
+vote_buffer = VoteBuffer()
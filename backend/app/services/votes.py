@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.queue import Queue, UserVote
+
+
+@dataclass
+class VoteResult:
+    votes: int
+    user_vote_type: bool | None
+    song_id: str
+    previous: bool | None
+
+    @property
+    def upvotes(self) -> int:
+        """How the song's number of upvotes changed: -1, 0 or 1."""
+        return int(self.user_vote_type is True) - int(self.previous is True)
+
+
+def apply_vote(previous: bool | None, vote_type: bool) -> tuple[int, bool | None]:
+    """Return the vote delta and the user's resulting vote for one tap.
+
+    Tapping the same direction again revokes the vote, tapping the other
+    direction flips it.
+    """
+    if previous is None:
+        return (1 if vote_type else -1), vote_type
+    if previous == vote_type:
+        return (-1 if vote_type else 1), None
+    return (2 if vote_type else -2), vote_type
+
+
+UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def upsert_user_votes(dialect_name: str):
+    """INSERT into user_votes that overwrites the vote_type of an existing row.
+
+    Votes also need RETURNING, so only SQLite and PostgreSQL are supported.
+    """
+    if dialect_name not in UPSERT_INSERTS:
+        raise ValueError(f"Votes are not supported on {dialect_name!r}; use SQLite or PostgreSQL")
+    statement = UPSERT_INSERTS[dialect_name](UserVote)
+    return statement.on_conflict_do_update(
+        index_elements=[UserVote.user_id, UserVote.queue_id],
+        set_={"vote_type": statement.excluded.vote_type}
+    )
+
+
+async def record_vote(db: AsyncSession, session_code: str, queue_id: int, user_id: str,
+                      vote_type: bool) -> VoteResult | None:
+    """Apply one vote atomically; returns None if the item is unknown.
+
+    The queue row is claimed first with a no-op UPDATE, which row-locks it
+    on PostgreSQL and takes the write lock on SQLite, so votes on the same
+    item run one after another. Only then is the user's previous vote
+    taken out with DELETE ... RETURNING, and the tally changed with a
+    relative UPDATE; a double tap can never apply the same delta twice.
+    Needs a database with RETURNING (SQLite 3.35+ or PostgreSQL).
+    """
+    item = update(Queue).where(Queue.id == queue_id, Queue.session_code == session_code)
+    song_id = (await db.execute(item.values(votes=Queue.votes).returning(Queue.song_id))).scalar()
+    if song_id is None:
+        await db.rollback()
+        return None
+
+    previous = (await db.execute(
+        delete(UserVote)
+        .where(UserVote.user_id == user_id, UserVote.queue_id == queue_id)
+        .returning(UserVote.vote_type)
+    )).scalar()
+    delta, user_vote_type = apply_vote(previous, vote_type)
+
+    if user_vote_type is not None:
+        await db.execute(
+            upsert_user_votes(db.bind.dialect.name),
+            {"user_id": user_id, "queue_id": queue_id, "vote_type": user_vote_type}
+        )
+    votes = (await db.execute(item.values(votes=Queue.votes + delta).returning(Queue.votes))).scalar()
+    await db.commit()
+    return VoteResult(votes, user_vote_type, song_id, previous)
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+from dotenv import load_dotenv
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from app.services.upstream import MusicProvider, UPSTREAM_TIMEOUT_S
+
+load_dotenv()
+
+YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+YOUTUBE_THREADS = int(os.getenv("YOUTUBE_THREADS", "4"))
+
+logger = logging.getLogger(__name__)
+
+
+class YouTubeProvider(MusicProvider):
+    """YouTube Data API search.
+
+    The API client is built once from the discovery document bundled with
+    google-api-python-client and shared by all searches. Its blocking calls
+    run in a small thread pool; httplib2 is not thread-safe, so each pool
+    thread executes requests with its own connection.
+    """
+
+    name = "youtube"
+
+    def __init__(self, api_key: str | None, max_workers: int = YOUTUBE_THREADS):
+        self.api_key = api_key
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._service = None
+        self._service_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="youtube")
+        return self._executor
+
+    def _get_service(self):
+        with self._service_lock:
+            if self._service is None:
+                self._service = build("youtube", "v3", developerKey=self.api_key, static_discovery=True, cache_discovery=False)
+            return self._service
+
+    def _thread_http(self) -> httplib2.Http:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=UPSTREAM_TIMEOUT_S)
+        return http
+
+    def _search(self, query: str, limit: int):
+        search_response = self._get_service().search().list(
+            q=query,
+            part="snippet",
+            maxResults=limit,
+            type="video",
+            topicId="/m/04rlf",  # Music topic
+            videoCategoryId="10" # Music category
+        ).execute(http=self._thread_http())
+
+        tracks = []
+        for item in search_response.get("items", []):
+            snippet = item["snippet"]
+            video_id = item["id"]["videoId"]
+            tracks.append({
+                "id": video_id,
+                "name": snippet["title"],
+                "artist_name": snippet["channelTitle"],
+                "audio": f"https://www.youtube.com/watch?v={video_id}",
+                "image": snippet["thumbnails"]["high"]["url"]
+            })
+        return tracks
+
+    async def start(self):
+        if self.api_key:
+            # Parse the discovery document before the first search needs it
+            await asyncio.get_running_loop().run_in_executor(self._pool(), self._get_service)
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def search_tracks(self, query: str, limit: int = 10):
+        if not self.api_key:
+            return None, "YouTube API key not configured"
+        try:
+            tracks = await asyncio.get_running_loop().run_in_executor(self._pool(), self._search, query, limit)
+        except HttpError as e:
+            logger.error(f"YouTube API error: {e}")
+            return None, f"YouTube API error: {e}"
+        except Exception as e:
+            logger.error(f"Failed to search YouTube: {e}")
+            return None, str(e)
+        return tracks, None
+
+
+youtube_provider = YouTubeProvider(api_key=YOUTUBE_API_KEY)
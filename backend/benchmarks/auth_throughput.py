@@ -0,0 +1,75 @@
+"""Measure authenticated request throughput with and without the token cache.
+
+Runs the app in-process against a scratch SQLite database. A few hundred
+guests join one session and GET /queue/list/{code} is sent round-robin over
+their tokens, first verifying every token (TOKEN_CACHE_SIZE=0) and then
+through the verified-token cache. Token verification alone is timed too.
+
+    python -m benchmarks.auth_throughput
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Keep the benchmark's database out of the working tree
+sys.path.insert(0, os.getcwd())
+os.chdir(tempfile.mkdtemp(prefix="aura-bench-"))
+
+import httpx  # noqa: E402
+
+from app.core import auth  # noqa: E402
+from app.core.auth import TokenCache, verify_token  # noqa: E402
+from app.main import app  # noqa: E402
+
+GUESTS = 300
+REQUESTS = 3000
+VERIFY_CALLS = 20_000
+
+
+def verify_rate(verify, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for n in range(VERIFY_CALLS):
+        verify(tokens[n % len(tokens)])
+    return VERIFY_CALLS / (time.perf_counter() - start)
+
+
+async def request_rate(client: httpx.AsyncClient, session_code: str, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for n in range(REQUESTS):
+        headers = {"Authorization": f"Bearer {tokens[n % len(tokens)]}"}
+        (await client.get(f"/queue/list/{session_code}", headers=headers)).raise_for_status()
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    from app.core.database import async_engine
+    from app.core.migrations import migrate
+    async with async_engine.begin() as connection:
+        await connection.run_sync(migrate)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        session_code = (await client.post("/session/create", json={"name": "bench"})).json()["session_code"]
+        tokens = [
+            (await client.post("/session/join", json={"session_code": session_code})).json()["token"]
+            for _ in range(GUESTS)
+        ]
+
+        verify = {"uncached": verify_rate(verify_token, tokens),
+                  "cached": verify_rate(TokenCache(max_entries=GUESTS).verify, tokens)}
+        requests = {}
+        for label, size in (("uncached", 0), ("cached", GUESTS)):
+            # get_current_user looks the cache up at call time
+            auth.token_cache = TokenCache(max_entries=size)
+            requests[label] = await request_rate(client, session_code, tokens)
+    await async_engine.dispose()
+
+    print(f"{'':>10} {'verify/s':>10} {'GET list/s':>13}")
+    for label in ("uncached", "cached"):
+        print(f"{label:>10} {verify[label]:>10,.0f} {requests[label]:>13,.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""Measure bytes on the wire and CPU cost of HTTP gzip and WebSocket permessage-deflate.
+
+Builds a queue of songs with realistic Jamendo-style URLs, then reports:
+
+- GET /queue/list payload size and gzip time at several compression levels;
+- per-message size for each WebSocket codec, raw and with
+  permessage-deflate (steady state, with context takeover as browsers
+  negotiate it), and the CPU spent compressing one broadcast for every
+  connection of a session (each socket has its own deflate context).
+
+    python -m benchmarks.compression
+"""
+import gzip
+import time
+from typing import Callable
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+from app.core import wire
+from app.models.queue import SongResponse
+
+SONGS = 200
+CONNECTIONS = 200
+ROUNDS = 20
+
+
+def song(n: int) -> dict:
+    return {
+        "id": n,
+        "song_id": str(1_800_000 + n),
+        "name": f"Song title number {n}",
+        "artist_name": f"Artist {n % 37}",
+        "audio": f"https://prod-1.storage.jamendo.com/?trackid={1_800_000 + n}&format=mp31&from=app-97dab294",
+        "image": f"https://usercontent.jamendo.com?type=album&id={400_000 + n // 10}&width=300&trackid={1_800_000 + n}",
+        "added_by": f"4f6d1c2e-8a7b-4c1d-9e2f-{n:012d}",
+        "votes": n % 7,
+    }
+
+
+def timed(fn, rounds: int = ROUNDS) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def http_report(body: bytes):
+    print(f"GET /queue/list ({SONGS} songs): {len(body):,} bytes uncompressed")
+    print(f"{'level':>7} {'bytes':>9} {'ratio':>7} {'time':>9}")
+    for level in (1, 5, 9):
+        compressed = gzip.compress(body, compresslevel=level)
+        seconds = timed(lambda: gzip.compress(body, compresslevel=level))
+        print(f"{level:>7} {len(compressed):>9,} {len(compressed) / len(body):>7.1%} {seconds * 1000:>7.3f}ms")
+
+
+def ws_report(messages: dict[str, Callable[[int], dict]]):
+    print(f"\nWebSocket frames (average of {ROUNDS} successive messages), {CONNECTIONS} connections per session")
+    print(f"{'message':>16} {'codec':>8} {'raw':>9} {'deflate':>9} {'cpu/broadcast':>14}")
+    for name, make in messages.items():
+        for codec in (wire.JSON, wire.MSGPACK):
+            frames = [wire.EncodedMessage(make(n)).frame(codec) for n in range(2 * ROUNDS)]
+            frames = [Frame(Opcode.TEXT, data.encode()) if isinstance(data, str) else Frame(Opcode.BINARY, data) for data in frames]
+            extension = PerMessageDeflate(False, False, 15, 15)
+            # A long-lived connection has already seen similar messages
+            for frame in frames[:ROUNDS]:
+                extension.encode(frame)
+            start = time.perf_counter()
+            compressed = sum(len(extension.encode(frame).data) for frame in frames[ROUNDS:]) / ROUNDS
+            per_socket = (time.perf_counter() - start) / ROUNDS
+            raw = sum(len(frame.data) for frame in frames[ROUNDS:]) / ROUNDS
+            print(f"{name:>16} {codec:>8} {raw:>9,.0f} {compressed:>9,.0f} {per_socket * CONNECTIONS * 1000:>12.2f}ms")
+
+
+def main():
+    songs = [song(n) for n in range(1, SONGS + 1)]
+    body = wire.encode_json([SongResponse(**item).model_dump() for item in songs]).encode()
+    http_report(body)
+
+    queue = [{**item, "queue_id": item["id"], "id": item["song_id"], "played": False, "position": item["id"] * 1024} for item in songs]
+    ws_report({
+        "queue_snapshot": lambda n: {"type": "queue_snapshot", "seq": n, "manual_sort": False,
+                                     "queue": [{**item, "votes": (item["votes"] + n) % 9} for item in queue]},
+        "queue_reordered": lambda n: {"type": "queue_reordered", "action": "moved", "manual_sort": True,
+                                      "order": [item["queue_id"] for item in queue[n:] + queue[:n]], "seq": n},
+        "queue_updated": lambda n: {"type": "queue_updated", "action": "added", "queue_id": SONGS + n,
+                                    "item": {**queue[n], "queue_id": SONGS + n}, "seq": n},
+        "vote_updated": lambda n: {"type": "vote_updated", "queue_id": 1 + n * 7 % SONGS, "votes": n % 5, "seq": n},
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare the hot queue queries before and after the index migration.
+
+Seeds a scratch SQLite database (10k sessions, 1M queue rows and a vote
+per ten rows by default) at schema version 1, prints the query plan and
+mean time of each hot query, then applies the remaining migrations and
+measures again.
+
+    python -m benchmarks.queue_indexes
+    python -m benchmarks.queue_indexes --sessions 1000 --songs 100
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from app.core.migrations import migrate
+
+HOT_QUERIES = {
+    "load unplayed queue": (
+        "SELECT * FROM queue WHERE session_code = :code AND played = 0 AND song_url IS NOT NULL"
+    ),
+    "smart sort page": (
+        "SELECT id FROM queue WHERE session_code = :code AND played = 0 ORDER BY votes DESC, id LIMIT 20"
+    ),
+    "manual sort page": (
+        "SELECT id FROM queue WHERE session_code = :code AND played = 0 ORDER BY position, id LIMIT 20"
+    ),
+    "next position": "SELECT max(position) FROM queue WHERE session_code = :code",
+    "participant votes": "SELECT queue_id, vote_type FROM user_votes WHERE user_id = :user",
+    "single vote": "SELECT vote_type FROM user_votes WHERE user_id = :user AND queue_id = :queue_id",
+}
+RUNS = 200
+
+
+def seed(connection, sessions: int, songs: int):
+    connection.exec_driver_sql(
+        "INSERT INTO sessions (session_code, host_id, manual_sort) VALUES (?, ?, 0)",
+        [(f"S{s:05d}", f"host{s}") for s in range(sessions)]
+    )
+    rows = (
+        (f"t{n}", f"S{n // songs:05d}", f"Song {n}", "Artist", "url", "img", "guest",
+         random.randint(-5, 20), n % songs < songs // 4, n % songs)
+        for n in range(sessions * songs)
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO queue (song_id, session_code, song_title, artist_name, song_url, image, added_by, votes, played, position)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        list(rows)
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO user_votes (user_id, queue_id, vote_type) VALUES (?, ?, ?)",
+        [(f"u{n % (sessions * 5)}", n + 1, n % 3 != 0) for n in range(0, sessions * songs, 10)]
+    )
+
+
+def measure(connection, sessions: int, songs: int):
+    def params():
+        n = random.randrange(sessions * songs)
+        return {"code": f"S{n // songs:05d}", "user": f"u{n % (sessions * 5)}", "queue_id": n + 1}
+
+    for name, sql in HOT_QUERIES.items():
+        plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params()).all()
+        start = time.perf_counter()
+        for _ in range(RUNS):
+            connection.execute(text(sql), params()).all()
+        elapsed = (time.perf_counter() - start) / RUNS * 1000
+        print(f"  {name:<20} {elapsed:>9.3f}ms  {' | '.join(row[-1] for row in plan)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--songs", type=int, default=100, help="queue rows per session")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="aura-bench-"), "indexes.db")
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        migrate(connection, target=1)
+        start = time.perf_counter()
+        seed(connection, args.sessions, args.songs)
+        print(f"Seeded {args.sessions} sessions, {args.sessions * args.songs} queue rows in {time.perf_counter() - start:.1f}s")
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+        print("\nBefore (schema version 1)")
+        measure(connection, args.sessions, args.songs)
+
+    with engine.begin() as connection:
+        start = time.perf_counter()
+        applied = migrate(connection)
+        connection.exec_driver_sql("ANALYZE")
+        print(f"\nAfter migrations {applied} ({time.perf_counter() - start:.1f}s)")
+        measure(connection, args.sessions, args.songs)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Measure /search/suggest lookup latency on a large catalog.
+
+Fills a TrackCatalog with synthetic tracks (50k by default) whose words
+come from a small vocabulary, so short prefixes match thousands of tracks,
+and reports p50/p99 suggestion time for one to three word queries typed
+one character at a time.
+
+    python -m benchmarks.suggest_latency
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app.services.track_catalog import TrackCatalog
+
+WORDS = [
+    "love", "night", "dance", "heart", "fire", "dream", "summer", "light", "blue", "golden",
+    "street", "river", "shadow", "electric", "midnight", "city", "wild", "forever", "home", "rain",
+    "daft", "punk", "queen", "moon", "star", "run", "baby", "soul", "disco", "funk",
+]
+
+
+def build(size: int) -> TrackCatalog:
+    catalog = TrackCatalog(max_tracks=size)
+    for n in range(size):
+        track = {
+            "id": f"t{n}",
+            "name": " ".join(random.sample(WORDS, 3)) + f" {n}",
+            "artist_name": " ".join(random.sample(WORDS, 2)),
+            "audio": f"url{n}",
+            "image": "img",
+        }
+        catalog.record_queued(track, times=random.randint(1, 50), upvotes=random.randint(0, 100))
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = build(args.tracks)
+    print(f"Indexed {len(catalog)} tracks in {time.perf_counter() - start:.1f}s")
+
+    timings = []
+    for _ in range(args.queries):
+        phrase = " ".join(random.sample(WORDS, random.randint(1, 3)))
+        # Every keystroke of the phrase is a lookup
+        for end in range(1, len(phrase) + 1):
+            start = time.perf_counter()
+            catalog.suggest(phrase[:end])
+            timings.append(time.perf_counter() - start)
+
+    quantiles = statistics.quantiles(timings, n=100)
+    print(f"{len(timings)} lookups: p50 {quantiles[49] * 1000:.3f}ms, p99 {quantiles[98] * 1000:.3f}ms, max {max(timings) * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Measure WebSocket broadcast fan-out latency as a session grows.
+
+Connects N in-memory clients (a tenth of them stalled, like phones on bad
+Wi-Fi) to a ConnectionManager and reports how long `broadcast` takes and
+how long until every healthy client has received the message.
+
+    python -m benchmarks.ws_fanout
+"""
+import asyncio
+import statistics
+import time
+
+from app.core.auth import TokenData
+from app.core.websocket import ConnectionManager
+
+ROUNDS = 50
+SIZES = (10, 100, 1000)
+MESSAGE = {"type": "vote_updated", "queue_id": 1, "votes": 0}
+
+
+class BenchWebSocket:
+    def __init__(self, stalled: bool):
+        self.stalled = stalled
+        self.received = 0
+        self.event = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        if self.stalled:
+            await asyncio.sleep(3600)
+        self.received += 1
+        self.event.set()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(size: int):
+    manager = ConnectionManager()
+    sockets = [BenchWebSocket(stalled=(i % 10 == 9)) for i in range(size)]
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, "bench", TokenData(user_id=f"u{i}", session_code="bench", role="guest"))
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    healthy = [ws for ws in sockets if not ws.stalled]
+
+    enqueue_times, delivery_times = [], []
+    for i in range(ROUNDS):
+        for ws in healthy:
+            ws.event.clear()
+        start = time.perf_counter()
+        await manager.broadcast("bench", dict(MESSAGE, votes=i))
+        enqueue_times.append(time.perf_counter() - start)
+        await asyncio.gather(*(ws.event.wait() for ws in healthy))
+        delivery_times.append(time.perf_counter() - start)
+
+    for client in list(manager.clients.values()):
+        await client.close()
+    return enqueue_times, delivery_times
+
+
+def ms(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+async def main():
+    print(f"{'clients':>8} {'enqueue p50':>12} {'enqueue p99':>12} {'delivery p50':>13} {'delivery p99':>13}")
+    for size in SIZES:
+        enqueue, delivery = await run(size)
+        print(f"{size:>8} {ms(enqueue, 50):>10.3f}ms {ms(enqueue, 99):>10.3f}ms {ms(delivery, 50):>11.3f}ms {ms(delivery, 99):>11.3f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
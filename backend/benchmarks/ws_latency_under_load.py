@@ -0,0 +1,115 @@
+"""Measure WebSocket broadcast latency while the vote endpoint is under load.
+
+Runs the app in-process against a scratch SQLite database. A probe
+broadcasts a timestamped message every few milliseconds to a set of
+in-memory listeners while guests hammer POST /queue/vote, and the script
+reports p50/p99 delivery latency with and without the vote load.
+
+    python -m benchmarks.ws_latency_under_load
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Keep the benchmark's database out of the working tree
+sys.path.insert(0, os.getcwd())
+os.chdir(tempfile.mkdtemp(prefix="aura-bench-"))
+
+import httpx  # noqa: E402
+
+from app.core.auth import TokenData  # noqa: E402
+from app.core.websocket import manager  # noqa: E402
+from app.main import app  # noqa: E402
+
+LISTENERS = 200
+GUESTS = 50
+VOTES_PER_GUEST = 40
+PROBE_INTERVAL = 0.005
+
+
+class ProbeWebSocket:
+    def __init__(self, latencies: list):
+        self.latencies = latencies
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        if '"probe"' in data:
+            sent_at = float(data.split('"sent_at":')[1].rstrip("}"))
+            self.latencies.append(time.perf_counter() - sent_at)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def probe(session_code: str, stop: asyncio.Event):
+    while not stop.is_set():
+        await manager.broadcast(session_code, {"type": "probe", "sent_at": time.perf_counter()})
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def vote_load(client: httpx.AsyncClient, session_code: str, queue_id: int):
+    async def guest():
+        token = (await client.post("/session/join", json={"session_code": session_code})).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for _ in range(VOTES_PER_GUEST):
+            await client.post("/queue/vote", headers=headers, json={"session_code": session_code, "queue_id": queue_id, "vote": True})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(guest() for _ in range(GUESTS)))
+    return GUESTS * VOTES_PER_GUEST / (time.perf_counter() - start)
+
+
+async def measure(session_code: str, load=None):
+    latencies: list[float] = []
+    sockets = [ProbeWebSocket(latencies) for _ in range(LISTENERS)]
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, session_code, TokenData(user_id=f"l{i}", session_code=session_code, role="guest"))
+        await asyncio.sleep(0)
+
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(session_code, stop))
+    rate = None
+    if load is None:
+        await asyncio.sleep(1)
+    else:
+        rate = await load
+    stop.set()
+    await probe_task
+    await asyncio.sleep(0.05)
+
+    for ws in sockets:
+        manager.disconnect(ws, session_code)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000, rate
+
+
+async def main():
+    from app.core.database import async_engine
+    from app.core.migrations import migrate
+    async with async_engine.begin() as connection:
+        await connection.run_sync(migrate)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        host = (await client.post("/session/create", json={"name": "bench"})).json()
+        session_code = host["session_code"]
+        headers = {"Authorization": f"Bearer {host['token']}"}
+        song = {"id": "b1", "name": "Bench", "artist_name": "Bench", "audio": "url", "image": "img", "added_by": "host"}
+        queue_id = (await client.post("/queue/add", headers=headers, json={"session_code": session_code, "song_data": song})).json()["id"]
+
+        idle = await measure(session_code)
+        loaded = await measure(session_code, vote_load(client, session_code, queue_id))
+    await async_engine.dispose()
+
+    print(f"{'':>10} {'p50':>9} {'p99':>9} {'votes/s':>9}")
+    print(f"{'idle':>10} {idle[0]:>7.2f}ms {idle[1]:>7.2f}ms {'-':>9}")
+    print(f"{'vote load':>10} {loaded[0]:>7.2f}ms {loaded[1]:>7.2f}ms {loaded[2]:>9.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,31 @@
+import asyncio
+import json
+import msgpack
 import pytest
+from fastapi import status
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool
 from app.core.database import Base, get_db
 from app.main import app
 from unittest.mock import MagicMock
 from app.models.queue import Queue, UserVote  # Import the Queue and UserVote models
+from app.services.queue_index import queue_index, SessionQueueIndex, QueueEntry
+from app.services.search_cache import search_cache, SearchCache
+from app.services.youtube_client import YouTubeProvider
+from app.services.upstream import MusicProvider
+from app.services.federated_search import provider_results
+from app.services.track_catalog import track_catalog, TrackCatalog
+from app.services.qr_codes import qr_codes
+from app.services.session_cache import session_cache
+from app.services.queue_positions import queue_rebalancer, position_counter
+from app.services.queue_read_model import queue_snapshots, encode_cursor
+from app.core.websocket import ConnectionManager
+from app.core import wire
+from app.core.playback import PlaybackSyncScheduler
+from app.core.auth import TokenData, TokenCache, create_access_token
 
 # Create a test database URL
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -16,17 +36,29 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The app itself talks to the same database through the async engine. TestClient
+# may run requests on different event loops, so connections are not pooled.
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 @pytest.fixture(name="session")
 def session_fixture():
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    queue_index.invalidate()
+    search_cache.clear()
+    track_catalog.clear()
+    qr_codes.clear()
+    session_cache.invalidate()
+    position_counter.invalidate()
     with TestingSessionLocal() as session:
         yield session
 
 @pytest.fixture(name="client")
 def client_fixture(session: Session):
-    def override_get_db():
-        yield session
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
     yield TestClient(app)
@@ -129,7 +161,7 @@ def test_get_session(client: TestClient):
     assert get_response.status_code == 200
     get_data = get_response.json()
     assert get_data["session_code"] == session_code
-    assert get_data["qr_code"] == ""
+    assert get_data["qr_code"] == f"/session/{session_code}/qr"
     assert get_data["host_id"] == host_id_expected
     assert get_data["name"] == session_name
     assert get_data["duration"] == session_duration
@@ -141,6 +173,59 @@ def test_get_non_existent_session(client: TestClient):
     assert get_response.status_code == 404
     assert get_response.json()["detail"] == "Session not found"
 
+def test_session_qr_code_is_rendered_once_and_cached(client: TestClient, mocker):
+    session_code = client.post("/session/create", json={"name": "QR"}).json()["session_code"]
+    render = mocker.spy(qr_codes, "render")
+
+    png = client.get(f"/session/{session_code}/qr")
+    assert png.status_code == 200
+    assert png.headers["content-type"] == "image/png"
+    assert png.content.startswith(b"\x89PNG")
+    assert "immutable" in png.headers["cache-control"]
+    etag = png.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith('W/')
+
+    # Rejoining guests get the cached image, or a 304 when they already have it
+    assert client.get(f"/session/{session_code}/qr").content == png.content
+    assert client.get(f"/session/{session_code}/qr", headers={"If-None-Match": etag}).status_code == 304
+    assert render.call_count == 1
+
+    svg = client.get(f"/session/{session_code}/qr?format=svg")
+    assert svg.headers["content-type"] == "image/svg+xml"
+    assert b"<svg" in svg.content and svg.headers["etag"] != etag
+
+    assert client.get(f"/session/{session_code}/qr?format=gif").status_code == 400
+    assert client.get("/session/nonexist/qr").status_code == 404
+
+def test_token_cache_honors_expiry_and_skips_invalid_tokens(mocker):
+    from datetime import timedelta
+    from fastapi import HTTPException
+    from jose import jwt
+
+    now = [0.0]
+    cache = TokenCache(max_entries=2, clock=lambda: now[0])
+    token = create_access_token({"user_id": "u1", "session_code": "ABC123", "role": "guest"}, timedelta(minutes=5))
+    exp = jwt.get_unverified_claims(token)["exp"]
+    decode = mocker.spy(jwt, "decode")
+
+    now[0] = exp - 60
+    assert cache.verify(token).user_id == "u1"
+    assert cache.verify(token).user_id == "u1"
+    assert (cache.hits, cache.misses, decode.call_count) == (1, 1, 1)
+
+    # Past exp the entry is dropped and the token verified again
+    now[0] = exp + 1
+    cache.verify(token)
+    assert decode.call_count == 2
+
+    with pytest.raises(HTTPException):
+        cache.verify("not-a-jwt")
+    assert cache.stats()["size"] == 1
+
+    for n in range(3):
+        cache.verify(create_access_token({"user_id": f"u{n}", "session_code": "ABC123", "role": "guest"}))
+    assert cache.stats()["size"] == 2
+
 # ---------------------------------------------------------------------------
 # Search tests
 # ---------------------------------------------------------------------------
@@ -167,6 +252,107 @@ def test_search_jamendo_error(client: TestClient, mocker):
     assert response.status_code == 500
     assert response.json()["detail"] == "Jamendo API Error"
 
+def test_search_results_are_cached_across_endpoints(client: TestClient, mocker):
+    mock_tracks = [{"id": "1", "name": "Song 1", "artist_name": "Artist 1", "audio": "url1", "image": "img1"}]
+    upstream = mocker.patch("app.services.jamendo_client.jamendo_client.search_tracks", return_value=(mock_tracks, None))
+    before = client.get("/search/cache/stats").json()
+
+    assert client.get("/search?query=Daft Punk&provider=jamendo").json()["tracks"] == mock_tracks
+    assert client.get("/search?query=daft  punk&provider=jamendo").json()["tracks"] == mock_tracks
+    assert client.get("/jamendo/search?query=DAFT PUNK").json()["tracks"] == mock_tracks
+
+    upstream.assert_called_once_with("daft punk")
+    stats = client.get("/search/cache/stats").json()
+    assert (stats["misses"] - before["misses"], stats["hits"] - before["hits"], stats["entries"]) == (1, 2, 1)
+
+def test_search_cache_coalesces_expires_and_evicts():
+    now = [0.0]
+    cache = SearchCache(max_entries=2, ttl=10, stale_ttl=20, clock=lambda: now[0])
+    calls = []
+
+    def loader(result):
+        async def load():
+            calls.append(result)
+            await asyncio.sleep(0.01)
+            return result
+        return load
+
+    async def scenario():
+        # Concurrent misses share one upstream request
+        results = await asyncio.gather(*(cache.get("jamendo", "Song", loader("v1")) for _ in range(5)))
+        assert results == ["v1"] * 5 and calls == ["v1"]
+        assert cache.coalesced == 4
+
+        # Stale entries are served while a single refresh runs
+        now[0] = 15
+        assert await cache.get("jamendo", "song", loader("v2")) == "v1"
+        assert await cache.get("jamendo", "song", loader("v3")) == "v1"
+        await asyncio.sleep(0.02)
+        assert calls == ["v1", "v2"]
+        assert await cache.get("jamendo", "song", loader("v4")) == "v2"
+
+        # Past the stale window it is a miss again
+        now[0] = 100
+        assert await cache.get("jamendo", "song", loader("v5")) == "v5"
+
+        # Failures are not cached, and the least recently used entry goes first
+        async def fail():
+            raise RuntimeError("upstream down")
+        with pytest.raises(RuntimeError):
+            await cache.get("youtube", "song", fail)
+        await cache.get("youtube", "song", loader("y1"))
+        await cache.get("jamendo", "other", loader("o1"))
+        assert cache.stats()["evictions"] == 1
+        assert await cache.get("youtube", "song", loader("y2")) == "y1"
+        assert await cache.get("jamendo", "song", loader("v6")) == "v6"
+
+    asyncio.run(scenario())
+
+class FakeProvider(MusicProvider):
+    def __init__(self, name, tracks=None, error=None, delay=0.0):
+        self.name, self.tracks, self.error, self.delay = name, tracks, error, delay
+
+    async def search_tracks(self, query: str, limit: int = 20):
+        await asyncio.sleep(self.delay)
+        return (None, self.error) if self.error else (self.tracks, None)
+
+def test_search_all_providers_merges_and_dedupes(client: TestClient, mocker):
+    jamendo_tracks = [
+        {"id": "j1", "name": "One More Time", "artist_name": "Daft Punk", "audio": "j-url1", "image": "img"},
+        {"id": "j2", "name": "Aerodynamic", "artist_name": "Daft Punk", "audio": "j-url2", "image": "img"},
+    ]
+    youtube_tracks = [
+        {"id": "y1", "name": "one more  time", "artist_name": "DAFT PUNK", "audio": "y-url1", "image": "img"},
+        {"id": "y2", "name": "Digital Love", "artist_name": "Daft Punk", "audio": "y-url2", "image": "img"},
+    ]
+    mocker.patch("app.services.jamendo_client.jamendo_client.search_tracks", return_value=(jamendo_tracks, None))
+    mocker.patch("app.routes.search.youtube_provider", FakeProvider("youtube", youtube_tracks, delay=0.01))
+
+    data = client.get("/search?query=daft punk&provider=all").json()
+    assert [(t["id"], t["provider"]) for t in data["tracks"]] == [("j1", "jamendo"), ("j2", "jamendo"), ("y2", "youtube")]
+    assert data["providers"]["jamendo"]["status"] == "ok"
+    assert data["providers"]["youtube"]["count"] == 2
+
+    # Streaming sends each provider's new tracks as they arrive, then a summary
+    response = client.get("/search?query=daft punk&provider=all&stream=true")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(m["type"], m.get("provider")) for m in lines] == [("results", "jamendo"), ("results", "youtube"), ("done", None)]
+    assert [t["id"] for t in lines[1]["tracks"]] == ["y2"]
+    assert lines[-1]["total"] == 3
+
+def test_federated_search_reports_errors_and_timeouts():
+    providers = [
+        FakeProvider("fast", [{"id": "1", "name": "A", "artist_name": "B"}]),
+        FakeProvider("broken", error="Upstream down"),
+        FakeProvider("slow", [{"id": "2", "name": "C", "artist_name": "D"}], delay=1),
+    ]
+
+    async def scenario():
+        return [(name, status["status"]) async for name, status, _ in provider_results(providers, "q", deadline_ms=50)]
+
+    assert asyncio.run(scenario()) == [("fast", "ok"), ("broken", "error"), ("slow", "timeout")]
+
 def test_search_invalid_provider(client: TestClient):
     response = client.get("/search?query=test&provider=invalid")
     
@@ -174,8 +360,8 @@ def test_search_invalid_provider(client: TestClient):
     assert response.json()["detail"] == "Invalid search provider"
 
 def test_search_youtube_success(client: TestClient, mocker):
-    # Mock the os.getenv to return a fake API key
-    mocker.patch("app.routes.search.YOUTUBE_API_KEY", "fake_key")
+    # A provider with a fake API key
+    mocker.patch("app.routes.search.youtube_provider", YouTubeProvider("fake_key"))
 
     # Mock the youtube service build and its chain of calls
     mock_youtube_instance = MagicMock()
@@ -191,7 +377,7 @@ def test_search_youtube_success(client: TestClient, mocker):
             }
         ]
     }
-    mocker.patch("app.routes.search.build", return_value=mock_youtube_instance)
+    build = mocker.patch("app.services.youtube_client.build", return_value=mock_youtube_instance)
 
     response = client.get("/search?query=test&provider=youtube")
 
@@ -205,8 +391,12 @@ def test_search_youtube_success(client: TestClient, mocker):
     assert track["artist_name"] == "YT Channel 1"
     assert track["image"] == "http://yt.com/thumb1.jpg"
 
+    # The API client is built once and reused by later searches
+    assert client.get("/search?query=other&provider=youtube").status_code == 200
+    build.assert_called_once()
+
 def test_search_youtube_no_api_key(client: TestClient, mocker):
-    mocker.patch("app.routes.search.YOUTUBE_API_KEY", None)
+    mocker.patch("app.routes.search.youtube_provider", YouTubeProvider(None))
     response = client.get("/search?query=test&provider=youtube")
     assert response.status_code == 500
     assert response.json()["detail"] == "YouTube API key not configured"
@@ -277,6 +467,44 @@ def test_add_song_to_non_existent_session(authed_client: dict):
     # The token is scoped to a different session, so the route returns 403
     assert response.status_code == 403
 
+def test_add_batch_inserts_in_one_transaction_and_broadcasts_once(authed_client: dict, mocker):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    engine_ = async_engine.sync_engine
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    first = {"id": "p0", "name": "Single", "artist_name": "Artist", "audio": "url0", "image": "img", "added_by": "user"}
+    ac.post("/queue/add", json={"session_code": session_code, "song_data": first})
+    songs = [{"id": f"p{i}", "name": f"Import {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+             for i in range(1, 201)]
+    broadcast = mocker.patch("app.routes.queue.broadcast_queue_patch")
+
+    event.listen(engine_, "before_cursor_execute", count_statement)
+    try:
+        response = ac.post("/queue/add-batch", json={"session_code": session_code, "songs": songs})
+    finally:
+        event.remove(engine_, "before_cursor_execute", count_statement)
+
+    assert response.status_code == 200
+    added = response.json()
+    assert [song["song_id"] for song in added] == [song["id"] for song in songs]
+    assert sum(statement.startswith("INSERT INTO queue") for statement in statements) == 1
+    # The next position comes from the counter, not a max() scan
+    assert not any("max(queue.position)" in statement for statement in statements)
+    broadcast.assert_called_once()
+    patch = broadcast.call_args.args[1]
+    assert patch["action"] == "added_batch" and patch["queue_ids"] == [song["id"] for song in added]
+
+    listed = ac.get(f"/queue/list/{session_code}").json()
+    assert [song["song_id"] for song in listed] == ["p0"] + [song["id"] for song in songs]
+
+    assert ac.post("/queue/add-batch", json={"session_code": session_code, "songs": []}).status_code == 400
+    invalid = ac.post("/queue/add-batch", json={"session_code": session_code, "songs": [{"id": "x"}]})
+    assert invalid.status_code == 422
+
 def test_list_queue_success(authed_client: dict):
     ac = authed_client["client"]
     session_code = authed_client["session_code"]
@@ -296,6 +524,121 @@ def test_list_queue_success(authed_client: dict):
     assert "Song One" in names
     assert "Song Two" in names
 
+def test_list_queue_pages_are_stable_while_votes_reorder(authed_client: dict):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    songs = [{"id": f"c{i}", "name": f"Cursor {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+             for i in range(12)]
+    ac.post("/queue/add-batch", json={"session_code": session_code, "songs": songs})
+    full = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+
+    def read_all(limit, between_pages=None):
+        seen, cursor = [], None
+        while True:
+            params = {"limit": limit} | ({"cursor": cursor} if cursor else {})
+            response = ac.get(f"/queue/list/{session_code}", params=params)
+            assert response.status_code == 200
+            seen += [song["id"] for song in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return seen
+            if between_pages:
+                between_pages()
+
+    assert read_all(5) == full
+
+    # The last song climbs to the top while the client is paging
+    def upvote_last():
+        ac.post("/queue/vote", json={"session_code": session_code, "queue_id": full[-1], "vote": True})
+    assert read_all(5, upvote_last) == full
+
+    # Without the snapshot (another worker) paging resumes from the cursor's key
+    ranked = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+    first = ac.get(f"/queue/list/{session_code}", params={"limit": 4})
+    queue_snapshots.clear()
+    rest = ac.get(f"/queue/list/{session_code}", params={"limit": 50, "cursor": first.headers["X-Next-Cursor"]})
+    assert [song["id"] for song in first.json() + rest.json()] == ranked
+    assert "X-Next-Cursor" not in rest.headers
+
+    assert ac.get(f"/queue/list/{session_code}", params={"cursor": "bogus"}).status_code == 400
+    negative = encode_cursor({"o": -1, "m": False, "k": [0, 0]})
+    assert ac.get(f"/queue/list/{session_code}", params={"cursor": negative}).status_code == 400
+
+def test_list_queue_window_shows_top_and_own_songs(authed_client: dict, client: TestClient):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    songs = [{"id": f"w{i}", "name": f"Window {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+             for i in range(10)]
+    ac.post("/queue/add-batch", json={"session_code": session_code, "songs": songs})
+    guest_token = client.post("/session/join", json={"session_code": session_code}).json()["token"]
+    guest = {"Authorization": f"Bearer {guest_token}"}
+    own = client.post("/queue/add", headers=guest, json={"session_code": session_code, "song_data": {**songs[0], "id": "mine"}}).json()
+
+    window = client.get(f"/queue/list/{session_code}", headers=guest, params={"window": 3}).json()
+    assert [(song["song_id"], song["rank"]) for song in window] == [("w0", 1), ("w1", 2), ("w2", 3), ("mine", 11)]
+    assert window[-1]["id"] == own["id"]
+    assert client.get(f"/queue/list/{session_code}", headers=guest, params={"window": 3, "limit": 2}).status_code == 400
+
+def test_session_and_queue_reads_answer_304_until_the_session_changes(authed_client: dict, client: TestClient):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    engine_ = async_engine.sync_engine
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    song = {"id": "e1", "name": "ETag", "artist_name": "Artist", "audio": "url", "image": "img", "added_by": "user"}
+    queue_id = ac.post("/queue/add", json={"session_code": session_code, "song_data": song}).json()["id"]
+
+    listed = ac.get(f"/queue/list/{session_code}")
+    session_info = client.get(f"/session/{session_code}")
+    queue_etag, session_etag = listed.headers["etag"], session_info.headers["etag"]
+    assert queue_etag.startswith('W/"') and session_etag.startswith('W/"')
+
+    event.listen(engine_, "before_cursor_execute", count_statement)
+    try:
+        assert ac.get(f"/queue/list/{session_code}", headers={"If-None-Match": queue_etag}).status_code == 304
+        assert client.get(f"/session/{session_code}", headers={"If-None-Match": session_etag}).status_code == 304
+    finally:
+        event.remove(engine_, "before_cursor_execute", count_statement)
+    assert statements == []
+
+    # The tag covers the caller (their votes are in the payload) and the query
+    guest_token = client.post("/session/join", json={"session_code": session_code}).json()["token"]
+    guest = {"Authorization": f"Bearer {guest_token}", "If-None-Match": queue_etag}
+    assert client.get(f"/queue/list/{session_code}", headers=guest).status_code == 200
+    assert ac.get(f"/queue/list/{session_code}?window=1", headers={"If-None-Match": queue_etag}).status_code == 200
+
+    ac.post("/queue/vote", json={"session_code": session_code, "queue_id": queue_id, "vote": True})
+    changed = ac.get(f"/queue/list/{session_code}", headers={"If-None-Match": queue_etag})
+    assert changed.status_code == 200 and changed.json()[0]["votes"] == 1
+
+    ac.post("/queue/toggle-smart-sort", json={"session_code": session_code, "enabled": False})
+    changed = client.get(f"/session/{session_code}", headers={"If-None-Match": session_etag})
+    assert changed.status_code == 200 and changed.json()["manual_sort"] is True
+
+def test_large_responses_are_gzipped(authed_client: dict, client: TestClient, mocker):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    songs = [{"id": f"z{i}", "name": f"Gzip {i}", "artist_name": "Artist", "audio": f"https://example.com/audio/{i}.mp3",
+              "image": "https://example.com/cover.jpg", "added_by": "user"} for i in range(40)]
+    ac.post("/queue/add-batch", json={"session_code": session_code, "songs": songs})
+
+    listed = ac.get(f"/queue/list/{session_code}", headers={"Accept-Encoding": "gzip"})
+    assert listed.headers["content-encoding"] == "gzip"
+    assert int(listed.headers["content-length"]) < len(listed.content) / 4
+    assert len(listed.json()) == 40
+
+    small = ac.get(f"/queue/list/{session_code}?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+    # Streamed search lines are not held back by the compressor
+    mocker.patch("app.services.jamendo_client.jamendo_client.search_tracks", return_value=([], None))
+    mocker.patch("app.routes.search.youtube_provider", FakeProvider("youtube", []))
+    streamed = client.get("/search?query=q&provider=all&stream=true", headers={"Accept-Encoding": "gzip"})
+    assert streamed.headers["content-encoding"] == "identity"
+
 def test_list_empty_queue(authed_client: dict):
     ac = authed_client["client"]
     session_code = authed_client["session_code"]
@@ -430,3 +773,643 @@ def test_vote_on_non_existent_item(song_in_queue):
     })
     assert response.status_code == 404
     assert response.json()["detail"] == "Queue item not found"
+
+def test_list_queue_statement_count_is_constant(authed_client: dict, session: Session):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    engine_ = async_engine.sync_engine
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def add_songs(count, offset=0):
+        for i in range(offset, offset + count):
+            song = {"id": f"n1_{i}", "name": f"Song {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+            ac.post("/queue/add", json={"session_code": session_code, "song_data": song})
+
+    def list_statements():
+        statements.clear()
+        event.listen(engine_, "before_cursor_execute", count_statement)
+        try:
+            response = ac.get(f"/queue/list/{session_code}")
+        finally:
+            event.remove(engine_, "before_cursor_execute", count_statement)
+        assert response.status_code == 200
+        return response.json(), len(statements)
+
+    add_songs(2)
+    first = ac.get(f"/queue/list/{session_code}").json()[0]
+    ac.post("/queue/vote", json={"session_code": session_code, "queue_id": first["id"], "vote": True})
+
+    short_queue, short_count = list_statements()
+    add_songs(25, offset=2)
+    long_queue, long_count = list_statements()
+
+    assert len(short_queue) == 2
+    assert len(long_queue) == 27
+    assert short_count == long_count
+    assert long_queue[0]["user_vote_type"] is True
+    assert all(song["user_vote_type"] is None for song in long_queue[1:])
+
+def test_steady_state_queue_requests_skip_sessions_table(authed_client: dict):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    engine_ = async_engine.sync_engine
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    song = {"id": "s1", "name": "Song", "artist_name": "Artist", "audio": "url", "image": "img", "added_by": "user"}
+    # Drop the entry written through by /session/create: the first read loads it
+    session_cache.invalidate()
+    event.listen(engine_, "before_cursor_execute", count_statement)
+    try:
+        ac.get(f"/queue/list/{session_code}")
+        assert sum("FROM sessions" in statement for statement in statements) == 1
+        statements.clear()
+        ac.post("/queue/add", json={"session_code": session_code, "song_data": song})
+        ac.get(f"/queue/list/{session_code}")
+        ac.get(f"/session/{session_code}")
+        ac.post("/session/join", json={"session_code": session_code})
+        toggled = ac.post("/queue/toggle-smart-sort", json={"session_code": session_code, "enabled": False})
+    finally:
+        event.remove(engine_, "before_cursor_execute", count_statement)
+
+    assert not any("FROM sessions" in statement for statement in statements)
+    assert toggled.json()["manual_sort"] is True
+    # Written through, and persisted
+    assert ac.get(f"/session/{session_code}").json()["manual_sort"] is True
+    session_cache.invalidate()
+    assert ac.get(f"/session/{session_code}").json()["manual_sort"] is True
+
+def test_session_cache_is_bounded_and_invalidated_by_remote_reorders():
+    from app.services.session_cache import SessionCache, SessionInfo
+
+    cache = SessionCache(max_entries=2)
+    for code in ("a", "b", "c"):
+        cache.put(SessionInfo(session_code=code, host_id="h", name=None, duration=None, manual_sort=False))
+    assert cache.peek("a") is None and cache.stats()["size"] == 2
+
+    session_cache.put(SessionInfo(session_code="remote", host_id="h", name=None, duration=None, manual_sort=False))
+    manager = ConnectionManager()
+    asyncio.run(manager._deliver_remote("remote", {"type": "vote_updated", "queue_id": 1, "votes": 2}))
+    assert session_cache.peek("remote") is not None
+    asyncio.run(manager._deliver_remote("remote", {"type": "queue_reordered", "manual_sort": True, "order": []}))
+    assert session_cache.peek("remote") is None
+
+# ---------------------------------------------------------------------------
+# Queue index tests
+# ---------------------------------------------------------------------------
+
+def _entry(queue_id, votes=0, position=0):
+    return QueueEntry(id=queue_id, song_id=f"s{queue_id}", session_code="idx", song_title=f"Song {queue_id}",
+                      artist_name="Artist", song_url="url", image="img", added_by="user", votes=votes, position=position)
+
+def test_queue_index_ranks_by_votes_and_position():
+    index = SessionQueueIndex([_entry(1, votes=0, position=3), _entry(2, votes=5, position=1), _entry(3, votes=5, position=2)])
+
+    assert [e.id for e in index.ranked()] == [2, 3, 1]
+
+    index.update_votes(1, 10)
+    index.add(_entry(4, votes=-1, position=4))
+    assert [e.id for e in index.ranked()] == [1, 2, 3, 4]
+    assert [e.id for e in index.ranked(limit=2)] == [1, 2]
+
+    index.manual_sort = True
+    assert [e.id for e in index.ranked()] == [2, 3, 1, 4]
+
+    index.set_positions({4: 1, 2: 2, 3: 3, 1: 4})
+    index.remove(4)
+    assert index.top().id == 2
+    assert [e.id for e in index.ranked()] == [2, 3, 1]
+
+def test_queue_index_reloads_when_a_write_overlaps_the_load(session: Session, mocker):
+    def row(song_id):
+        return Queue(session_code="race", song_id=song_id, song_title=song_id, artist_name="A", song_url="url",
+                     image="img", added_by="user", position=1)
+
+    session.add(row("before"))
+    session.commit()
+    load = queue_index._load
+    loaded, release = asyncio.Event(), asyncio.Event()
+    loads = []
+
+    async def paused_load(db, session_code):
+        index = await load(db, session_code)
+        loads.append(index)
+        if len(loads) == 1:
+            # The rows are read; hold the result while a song is added
+            loaded.set()
+            await release.wait()
+        return index
+
+    mocker.patch.object(queue_index, "_load", paused_load)
+
+    async def scenario():
+        async with TestingAsyncSessionLocal() as reader, TestingAsyncSessionLocal() as writer:
+            task = asyncio.create_task(queue_index.get(reader, "race"))
+            await loaded.wait()
+            writer.add(row("during"))
+            await writer.commit()
+            assert queue_index.for_update("race") is None
+            release.set()
+            return await task
+
+    index = asyncio.run(scenario())
+    assert len(loads) == 2
+    assert sorted(entry.song_id for entry in index.ranked()) == ["before", "during"]
+    assert queue_index.peek("race") is index
+
+def test_per_session_state_is_bounded(session: Session):
+    from app.services.queue_index import QueueIndexRegistry
+    from app.services.queue_positions import PositionCounter, QueueRebalancer
+
+    registry, counter = QueueIndexRegistry(max_sessions=2), PositionCounter(max_sessions=2)
+    rebalancer = QueueRebalancer(session_factory=TestingAsyncSessionLocal)
+
+    async def scenario():
+        async with TestingAsyncSessionLocal() as db:
+            for code in ("A", "B", "A", "C"):
+                await registry.get(db, code)
+                registry.for_update(code)
+                await counter.reserve(db, code)
+        async def hold():
+            async with rebalancer.lock("A"):
+                await asyncio.sleep(0)
+
+        # The lock is shared while anyone holds or awaits it, then dropped
+        tasks = [asyncio.create_task(hold()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert list(rebalancer._locks) == ["A"] and rebalancer._locks["A"][1] == 3
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    # Least recently used session out
+    assert list(registry._sessions) == ["A", "C"]
+    assert list(registry._generations) == ["A", "C"]
+    assert list(counter._last) == ["A", "C"]
+    assert rebalancer._locks == {}
+
+def test_list_queue_follows_manual_sort(authed_client: dict):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+
+    ids = []
+    for i in range(3):
+        song = {"id": f"m{i}", "name": f"Manual {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+        ids.append(ac.post("/queue/add", json={"session_code": session_code, "song_data": song}).json()["id"])
+    ac.post("/queue/vote", json={"session_code": session_code, "queue_id": ids[2], "vote": True})
+
+    listed = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+    assert listed == [ids[2], ids[0], ids[1]]
+
+    assert ac.post("/queue/reorder", json={"session_code": session_code, "order": [ids[1], ids[0], ids[2]]}).status_code == 200
+    listed = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+    assert listed == [ids[1], ids[0], ids[2]]
+
+    ac.post("/queue/toggle-smart-sort", json={"session_code": session_code, "enabled": True})
+    ac.post("/queue/play", json={"session_code": session_code, "queue_id": ids[0]})
+    listed = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+    assert listed == [ids[2], ids[1]]
+
+def test_reorder_and_move_write_in_single_statements(authed_client: dict):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    engine_ = async_engine.sync_engine
+    updates = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE queue"):
+            updates.append(statement)
+
+    ids = []
+    for i in range(30):
+        song = {"id": f"r{i}", "name": f"Reorder {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+        ids.append(ac.post("/queue/add", json={"session_code": session_code, "song_data": song}).json()["id"])
+
+    event.listen(engine_, "before_cursor_execute", count_statement)
+    try:
+        reordered = ac.post("/queue/reorder", json={"session_code": session_code, "order": ids[::-1]})
+        assert len(updates) == 1
+        updates.clear()
+        moved = ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[0], "after_id": ids[29]})
+        assert len(updates) == 1
+    finally:
+        event.remove(engine_, "before_cursor_execute", count_statement)
+
+    assert [song["id"] for song in reordered.json()["queue"]] == ids[::-1]
+    assert moved.status_code == 200
+    expected = [ids[29], ids[0]] + ids[28:0:-1]
+    assert [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()] == expected
+
+    top = ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[5], "after_id": None})
+    assert top.status_code == 200
+    assert ac.get(f"/queue/list/{session_code}").json()[0]["id"] == ids[5]
+    assert ac.post("/queue/move", json={"session_code": session_code, "queue_id": 999999}).status_code == 404
+    assert ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[1], "after_id": ids[1]}).status_code == 400
+
+def test_move_rebalances_when_gaps_run_out(authed_client: dict, session: Session, mocker):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    # Dense positions, as written before moves existed
+    rows = [Queue(session_code=session_code, song_id=f"d{i}", song_title=f"Dense {i}", artist_name="A", song_url="url",
+                  image="img", added_by="user", position=i) for i in range(1, 4)]
+    session.add_all(rows)
+    session.commit()
+    ids = [row.id for row in rows]
+    schedule = mocker.patch.object(queue_rebalancer, "schedule")
+
+    # No room between positions 1 and 2: the queue is respaced inline
+    ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[2], "after_id": ids[0]})
+    assert [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()] == [ids[0], ids[2], ids[1]]
+    session.expire_all()
+    assert {row.position for row in session.query(Queue).all()} == {1024, 1536, 2048}
+    schedule.assert_not_called()
+
+    # Halve the gap in front of ids[1] until a background rebalance is due
+    while not schedule.called:
+        ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[2], "after_id": ids[0]})
+        ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[0], "after_id": ids[2]})
+    order = [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()]
+
+    mocker.patch.object(queue_rebalancer, "session_factory", TestingAsyncSessionLocal)
+    broadcast = mocker.patch("app.core.websocket.broadcast_queue_patch")
+    asyncio.run(queue_rebalancer._run(session_code))
+    session.expire_all()
+    by_position = sorted(session.query(Queue).all(), key=lambda row: row.position)
+    assert [row.id for row in by_position] == order
+    assert [row.position for row in by_position] == [1024, 2048, 3072]
+    assert [song["id"] for song in ac.get(f"/queue/list/{session_code}").json()] == order
+    # Other workers are told, so they drop their copy of the old positions
+    broadcast.assert_called_once_with(session_code, {"type": "queue_reordered", "action": "rebalanced", "order": order})
+
+def test_move_reads_neighbours_from_the_database(authed_client: dict, session: Session):
+    ac = authed_client["client"]
+    session_code = authed_client["session_code"]
+    ids = []
+    for i in range(3):
+        song = {"id": f"n{i}", "name": f"Neighbour {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+        ids.append(ac.post("/queue/add", json={"session_code": session_code, "song_data": song}).json()["id"])
+    ac.get(f"/queue/list/{session_code}")
+
+    # Another worker respaced the queue; this worker's index still has the old positions
+    for queue_id, position in zip(ids, (10, 20, 30)):
+        session.get(Queue, queue_id).position = position
+    session.commit()
+
+    assert ac.post("/queue/move", json={"session_code": session_code, "queue_id": ids[2], "after_id": ids[0]}).status_code == 200
+    session.expire_all()
+    assert 10 < session.get(Queue, ids[2]).position < 20
+
+# ---------------------------------------------------------------------------
+# WebSocket tests
+# ---------------------------------------------------------------------------
+
+def test_websocket_queue_patches_and_resync(authed_client: dict):
+    session_code = authed_client["session_code"]
+    token = authed_client["token"]
+
+    with TestClient(app, headers={"Authorization": f"Bearer {token}"}) as ac:
+        with ac.websocket_connect(f"/ws/{session_code}?token={token}") as ws:
+            assert ws.receive_json()["type"] == "participant_count_updated"
+            snapshot = ws.receive_json()
+            assert snapshot["type"] == "queue_snapshot"
+            assert snapshot["queue"] == []
+            base_seq = snapshot["seq"]
+
+            for i in range(2):
+                song = {"id": f"ws{i}", "name": f"WS Song {i}", "artist_name": "Artist", "audio": f"url{i}", "image": "img", "added_by": "user"}
+                ac.post("/queue/add", json={"session_code": session_code, "song_data": song})
+            added = [ws.receive_json(), ws.receive_json()]
+            assert [m["action"] for m in added] == ["added", "added"]
+            assert [m["seq"] for m in added] == [base_seq + 1, base_seq + 2]
+            assert added[0]["item"]["name"] == "WS Song 0"
+
+            ws.send_json({"type": "playback_control", "action": "next"})
+            removed = ws.receive_json()
+            assert removed == {"type": "queue_updated", "action": "removed", "queue_id": added[0]["queue_id"], "seq": base_seq + 3}
+
+            ws.send_json({"type": "resync"})
+            snapshot = ws.receive_json()
+            assert snapshot["type"] == "queue_snapshot"
+            assert snapshot["seq"] == base_seq + 3
+            assert [song["queue_id"] for song in snapshot["queue"]] == [added[1]["queue_id"]]
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(msgpack.unpackb(data))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+def _token(user_id: str, role: str = "guest"):
+    return TokenData(user_id=user_id, session_code="fanout", role=role)
+
+@pytest.mark.parametrize("policy", ["drop", "snapshot"])
+def test_broadcast_does_not_wait_for_slow_clients(policy):
+    async def scenario():
+        manager = ConnectionManager(max_queue=4, slow_client_policy=policy)
+        queue_index._sessions["fanout"] = SessionQueueIndex([_entry(1, votes=3)])
+        fast = [FakeWebSocket() for _ in range(3)]
+        slow = FakeWebSocket(delay=60)
+        for i, ws in enumerate(fast + [slow]):
+            await manager.connect(ws, "fanout", _token(f"u{i}"))
+            await asyncio.sleep(0)
+
+        for i in range(10):
+            await manager.broadcast("fanout", {"type": "vote_updated", "queue_id": 1, "votes": i})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.05)
+
+        for ws in fast:
+            assert ws.sent[-1] == {"type": "vote_updated", "queue_id": 1, "votes": 9}
+        metrics = manager.metrics()
+        assert metrics["dropped_messages"] >= 1
+        if policy == "drop":
+            assert slow not in manager.active_connections["fanout"]
+            assert metrics["dropped_clients"] == 1
+            assert slow.closed_with == status.WS_1013_TRY_AGAIN_LATER
+        else:
+            assert slow in manager.active_connections["fanout"]
+            assert metrics["snapshots_sent"] >= 1
+            assert json.loads(manager.clients[slow].queue.get_nowait())["type"] == "queue_snapshot"
+        for client in list(manager.clients.values()):
+            await client.close()
+
+    asyncio.run(scenario())
+
+def test_websocket_metrics_endpoint(client: TestClient):
+    response = client.get("/ws/metrics")
+    assert response.status_code == 200
+    assert {"connections", "queue_depth_max", "dropped_messages"} <= response.json().keys()
+
+def test_broadcast_encodes_once_per_codec(mocker):
+    encode_json = mocker.spy(wire, "encode_json")
+    encode_msgpack = mocker.spy(wire, "encode_msgpack")
+
+    async def scenario():
+        manager = ConnectionManager()
+        json_clients = [FakeWebSocket() for _ in range(3)]
+        msgpack_clients = [FakeWebSocket() for _ in range(2)]
+        for i, ws in enumerate(json_clients):
+            await manager.connect(ws, "codec", _token(f"j{i}"))
+        for i, ws in enumerate(msgpack_clients):
+            await manager.connect(ws, "codec", _token(f"m{i}"), wire.MSGPACK_SUBPROTOCOL)
+        await asyncio.sleep(0)
+
+        encode_json.reset_mock()
+        message = {"type": "vote_updated", "queue_id": 7, "votes": 3, "seq": 1}
+        await manager.broadcast("codec", message)
+        await asyncio.sleep(0.01)
+
+        assert encode_json.call_count == 1
+        assert encode_msgpack.call_count == 1
+        for ws in json_clients + msgpack_clients:
+            assert ws.sent[-1] == message
+        for client in list(manager.clients.values()):
+            await client.close()
+
+    asyncio.run(scenario())
+
+def test_websocket_negotiates_msgpack(authed_client: dict):
+    session_code = authed_client["session_code"]
+    token = authed_client["token"]
+
+    with TestClient(app) as ac:
+        with ac.websocket_connect(f"/ws/{session_code}?token={token}", subprotocols=[wire.MSGPACK_SUBPROTOCOL]) as ws:
+            assert ws.accepted_subprotocol == wire.MSGPACK_SUBPROTOCOL
+            # Non-binary message types stay JSON text
+            assert ws.receive_json()["type"] == "participant_count_updated"
+            assert ws.receive_json()["type"] == "queue_snapshot"
+
+            ws.send_json({"type": "playback_sync", "action": "play", "currentTime": 1.5})
+            assert msgpack.unpackb(ws.receive_bytes()) == {"type": "playback_sync", "action": "play", "currentTime": 1.5}
+
+def test_playback_sync_progress_is_coalesced():
+    async def scenario():
+        sent = []
+
+        async def record(session_code, message):
+            sent.append(message)
+
+        scheduler = PlaybackSyncScheduler(record, interval_ms=30)
+        for t in range(20):
+            await scheduler.submit("sync", {"type": "playback_sync", "action": "progress", "currentTime": t})
+        assert sent == []
+
+        await asyncio.sleep(0.06)
+        assert sent == [{"type": "playback_sync", "action": "progress", "currentTime": 19}]
+
+        await scheduler.submit("sync", {"type": "playback_sync", "action": "progress", "currentTime": 20})
+        await scheduler.submit("sync", {"type": "playback_sync", "action": "pause", "currentTime": 20.5})
+        assert sent[-1]["action"] == "pause"
+
+        await asyncio.sleep(0.06)
+        # The stale progress update queued before the pause is never sent
+        assert [m["action"] for m in sent] == ["progress", "pause"]
+        assert (scheduler.received, scheduler.sent) == (22, 2)
+
+    asyncio.run(scenario())
+
+
+def test_playback_state_is_stored_before_coalescing():
+    async def scenario():
+        manager = ConnectionManager()
+        manager.playback.interval = 60
+        for t in range(3):
+            await manager.relay_playback("sync", {"type": "playback_sync", "action": "progress", "currentTime": t})
+        # Joiners see the latest position although the broadcast is still pending
+        assert await manager.backplane.get_playback_state("sync") == {"type": "playback_sync", "action": "progress", "currentTime": 2}
+        assert manager.playback.sent == 0
+        manager.playback.discard("sync")
+
+    asyncio.run(scenario())
+
+
+def test_database_engines_are_tuned(tmp_path):
+    from app.core.database import DB_POOL_SIZE, create_engines, describe_engine, to_async_url
+
+    assert to_async_url("sqlite:///./aura.db") == "sqlite+aiosqlite:///./aura.db"
+    assert to_async_url("postgresql://u:p@db/aura") == "postgresql+asyncpg://u:p@db/aura"
+    assert to_async_url("postgresql+psycopg://db/aura") == "postgresql+psycopg://db/aura"
+    with pytest.raises(ValueError):
+        create_engines("mysql://u:p@db/aura")
+
+    sync_engine, async_engine = create_engines(f"sqlite:///{tmp_path / 'tuned.db'}")
+
+    async def describe():
+        settings = await describe_engine(async_engine)
+        await async_engine.dispose()
+        return settings
+
+    # The report covers the async engine, which serves the requests
+    settings = asyncio.run(describe())
+    assert settings["pool"] == "AsyncAdaptedQueuePool"
+    assert settings["pool_size"] == DB_POOL_SIZE
+    assert settings["journal_mode"] == "wal"
+    assert settings["synchronous"] == 1  # NORMAL
+    assert settings["busy_timeout"] > 0
+
+    assert sync_engine.pool.size() == DB_POOL_SIZE
+    with sync_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    sync_engine.dispose()
+
+
+def test_write_behind_votes_are_flushed_in_batches(song_in_queue, session: Session, monkeypatch):
+    from app.services.vote_buffer import VoteBuffer
+
+    buffer = VoteBuffer(enabled=True, session_factory=TestingAsyncSessionLocal)
+    for module in ("app.routes.queue", "app.services.queue_read_model", "app.services.queue_index", "app.core.websocket"):
+        monkeypatch.setattr(f"{module}.vote_buffer", buffer)
+
+    ac, session_code, queue_id = song_in_queue["client"], song_in_queue["session_code"], song_in_queue["queue_id"]
+
+    def vote(up: bool):
+        response = ac.post("/queue/vote", json={"session_code": session_code, "queue_id": queue_id, "vote": up})
+        assert response.status_code == 200
+        return response.json()
+
+    assert vote(True)["votes"] == 1
+    assert vote(False) == {"message": "Vote recorded", "votes": -1, "user_vote_type": False}
+
+    # Nothing is written yet, but reads already see the buffered vote
+    assert session.get(Queue, queue_id).votes == 0
+    assert session.query(UserVote).count() == 0
+    queue_index.invalidate()
+    listed = ac.get(f"/queue/list/{session_code}").json()
+    assert (listed[0]["votes"], listed[0]["user_vote_type"]) == (-1, False)
+
+    assert asyncio.run(buffer.flush()) == 1
+    session.expire_all()
+    assert session.get(Queue, queue_id).votes == -1
+    assert [(v.queue_id, v.vote_type) for v in session.query(UserVote)] == [(queue_id, False)]
+
+    # Revoking, then playing the song; shutdown writes what is left
+    assert vote(False)["user_vote_type"] is None
+    assert ac.post("/queue/play", json={"session_code": session_code, "queue_id": queue_id}).status_code == 200
+    asyncio.run(buffer.stop())
+    session.expire_all()
+    assert session.get(Queue, queue_id).votes == 0
+    assert session.query(UserVote).count() == 0
+    assert buffer.tally(queue_id, default=None) is None
+
+    # Items of a session whose index is no longer loaded are dropped once written
+    song = {"id": "idle", "name": "Idle", "artist_name": "Artist", "audio": "url-idle", "image": "img", "added_by": "user"}
+    queue_id = ac.post("/queue/add", json={"session_code": session_code, "song_data": song}).json()["id"]
+    assert vote(True)["votes"] == 1
+    queue_index.invalidate()
+    assert asyncio.run(buffer.flush()) == 1
+    assert buffer.tally(queue_id, default=None) is None
+    assert vote(True) == {"message": "Vote recorded", "votes": 0, "user_vote_type": None}
+
+    missing = ac.post("/queue/vote", json={"session_code": session_code, "queue_id": 999, "vote": True})
+    assert missing.status_code == 404
+
+
+def test_vote_upsert_is_limited_to_supported_databases():
+    from sqlalchemy.dialects import postgresql, sqlite
+    from app.services.votes import upsert_user_votes
+
+    assert "ON CONFLICT" in str(upsert_user_votes("sqlite").compile(dialect=sqlite.dialect()))
+    assert "ON CONFLICT" in str(upsert_user_votes("postgresql").compile(dialect=postgresql.dialect()))
+    with pytest.raises(ValueError):
+        upsert_user_votes("mysql")
+
+
+def test_concurrent_votes_are_counted_exactly(song_in_queue, session: Session):
+    import httpx
+
+    session_code, queue_id = song_in_queue["session_code"], song_in_queue["queue_id"]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def guest(up: bool, flips: int):
+                token = (await client.post("/session/join", json={"session_code": session_code})).json()["token"]
+                headers = {"Authorization": f"Bearer {token}"}
+                for i in range(flips + 1):
+                    vote = up if i % 2 == 0 else not up
+                    response = await client.post("/queue/vote", headers=headers,
+                                                 json={"session_code": session_code, "queue_id": queue_id, "vote": vote})
+                    assert response.status_code == 200
+
+            # 30 upvotes, 10 downvotes, and 10 guests that end up downvoting after flipping twice
+            await asyncio.gather(
+                *(guest(True, 0) for _ in range(30)),
+                *(guest(False, 0) for _ in range(10)),
+                *(guest(False, 2) for _ in range(10)),
+            )
+
+            # A double tap votes and revokes, whichever request runs first
+            token = (await client.post("/session/join", json={"session_code": session_code})).json()["token"]
+            tap = {"session_code": session_code, "queue_id": queue_id, "vote": True}
+            taps = await asyncio.gather(*(client.post("/queue/vote", json=tap, headers={"Authorization": f"Bearer {token}"})
+                                          for _ in range(2)))
+            assert sorted(response.json()["votes"] for response in taps) == [10, 11]
+
+    asyncio.run(scenario())
+    session.expire_all()
+    assert session.get(Queue, queue_id).votes == 30 - 10 - 10
+    assert session.query(UserVote).filter(UserVote.queue_id == queue_id).count() == 50
+
+
+def test_suggest_ranks_tracks_by_queue_popularity(authed_client: dict, mocker):
+    ac, session_code = authed_client["client"], authed_client["session_code"]
+
+    def add(song_id, name, artist):
+        song = {"id": song_id, "name": name, "artist_name": artist, "audio": f"url-{song_id}", "image": "img", "added_by": "host"}
+        response = ac.post("/queue/add", json={"session_code": session_code, "song_data": song})
+        return response.json()["id"]
+
+    add("s1", "Harder Better Faster", "Daft Punk")
+    popular = add("s2", "Harder Than You Think", "Public Enemy")
+    add("s2", "Harder Than You Think", "Public Enemy")
+    # Upvote, revoke, flip to a downvote and back: one upvote in the end
+    for up in (True, True, False, True):
+        ac.post("/queue/vote", json={"session_code": session_code, "queue_id": popular, "vote": up})
+
+    # Tracks seen in search results are suggested too, after queued ones
+    mocker.patch("app.services.jamendo_client.jamendo_client.search_tracks", return_value=(
+        [{"id": "s3", "name": "Hard Times", "artist_name": "Paramore", "audio": "url-s3", "image": "img"}], None
+    ))
+    ac.get("/search?query=hard&provider=jamendo")
+
+    suggestions = ac.get("/search/suggest?query=HARD").json()["tracks"]
+    assert [(t["id"], t["queued"], t["upvotes"]) for t in suggestions] == [("s2", 2, 1), ("s1", 1, 0), ("s3", 0, 0)]
+    assert [t["id"] for t in ac.get("/search/suggest?query=harder da").json()["tracks"]] == ["s1"]
+    assert ac.get("/search/suggest?query=zzz").json()["tracks"] == []
+
+
+def test_track_catalog_loads_popularity_from_queue(session: Session):
+    for votes in (3, -1, 0):
+        session.add(Queue(session_code="CAT1", song_id="j9", song_title="Da Funk", artist_name="Daft Punk",
+                          song_url="url", image="img", added_by="u", votes=votes))
+    session.add(Queue(session_code="CAT1", song_id="j8", song_title="Dancing Queen", artist_name="ABBA",
+                      song_url="url", image="img", added_by="u", votes=0))
+    session.commit()
+
+    async def load():
+        catalog = TrackCatalog()
+        async with TestingAsyncSessionLocal() as db:
+            await catalog.load(db)
+        return catalog
+
+    catalog = asyncio.run(load())
+    assert [(t.id, t.queued, t.upvotes) for t in catalog.suggest("da")] == [("j9", 3, 3), ("j8", 1, 0)]
+
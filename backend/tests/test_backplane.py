@@ -0,0 +1,199 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.auth import TokenData
+from app.core.backplane import BackplaneHub, RedisBackplane, RespBackplane, UnixSocketBackplane, create_backplane, InProcessBackplane
+from app.core.websocket import ConnectionManager
+from app.services.queue_index import queue_index, SessionQueueIndex
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _token(user_id: str):
+    return TokenData(user_id=user_id, session_code="bp", role="guest")
+
+
+async def _wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+async def _exercise(worker_a: ConnectionManager, worker_b: ConnectionManager):
+    guest_a, guest_b = FakeWebSocket(), FakeWebSocket()
+    await worker_a.connect(guest_a, "bp", _token("a"))
+    await worker_b.connect(guest_b, "bp", _token("b"))
+
+    # Participant counts are shared across workers
+    await _wait_for(lambda: {"type": "participant_count_updated", "count": 2} in guest_a.sent)
+
+    # Queue patches reach the other worker's sockets with a shared sequence
+    queue_index._sessions["bp"] = SessionQueueIndex()
+    first = await worker_a.next_sequence("bp")
+    await worker_a.broadcast("bp", {"type": "vote_updated", "queue_id": 1, "votes": 1, "seq": first})
+    second = await worker_b.next_sequence("bp")
+    assert second == first + 1
+    # Both workers report the same session version
+    assert await worker_a.session_version("bp") == await worker_b.session_version("bp")
+    await _wait_for(lambda: any(m.get("seq") == first for m in guest_b.sent))
+    # ...and invalidate that worker's in-memory queue index
+    assert queue_index.peek("bp") is None
+
+    # Playback state relayed by one worker is visible to late joiners on another
+    await worker_a.relay_playback("bp", {"type": "playback_sync", "action": "play", "currentTime": 3})
+    assert await worker_b.backplane.get_playback_state("bp") == {"type": "playback_sync", "action": "play", "currentTime": 3}
+    await _wait_for(lambda: any(m.get("type") == "playback_sync" for m in guest_b.sent))
+
+    await worker_b.leave(guest_b, "bp")
+    # The last socket of the session on that worker is gone
+    assert "bp" not in worker_b.sequences
+    await _wait_for(lambda: guest_a.sent[-1] == {"type": "participant_count_updated", "count": 1})
+
+    for worker in (worker_a, worker_b):
+        for client in list(worker.clients.values()):
+            await client.close()
+        await worker.stop_backplane()
+
+
+def test_unix_socket_backplane_relays_between_workers(tmp_path):
+    path = str(tmp_path / "aura.sock")
+
+    async def scenario():
+        worker_a, worker_b = ConnectionManager(), ConnectionManager()
+        await worker_a.start_backplane(UnixSocketBackplane(path))
+        await worker_b.start_backplane(UnixSocketBackplane(path))
+        # Only the first worker took the lock and serves the hub
+        assert worker_a.backplane.hub is not None
+        assert worker_b.backplane.hub is None
+        await _exercise(worker_a, worker_b)
+
+    asyncio.run(scenario())
+
+
+def test_redis_backplane_against_local_stand_in():
+    async def scenario():
+        hub = BackplaneHub()
+        server = await hub.start_tcp("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        worker_a, worker_b = ConnectionManager(), ConnectionManager()
+        await worker_a.start_backplane(RedisBackplane(f"redis://127.0.0.1:{port}"))
+        await worker_b.start_backplane(RedisBackplane(f"redis://127.0.0.1:{port}"))
+        await _exercise(worker_a, worker_b)
+        await hub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_resp_backplane_degrades_to_local_state_when_unreachable():
+    async def scenario():
+        hub = BackplaneHub()
+        server = await hub.start_tcp("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backplane = RedisBackplane(f"redis://127.0.0.1:{port}")
+        assert [await backplane.next_sequence("bp") for _ in range(2)] == [1, 2]
+        backplane._commands[1].close()
+        backplane._commands = None
+        await hub.stop()
+
+        # Nothing listens any more: commands fail, requests carry on
+        assert await backplane.next_sequence("bp") == 3
+        assert await backplane.current_sequence("bp") == 3
+        assert await backplane.add_participants("bp", 1) == 1
+        await backplane.set_playback_state("bp", {"action": "play"})
+        assert await backplane.get_playback_state("bp") == {"action": "play"}
+
+    asyncio.run(scenario())
+
+
+def test_resp_backplane_resyncs_caches_after_missed_events():
+    async def scenario():
+        hub = BackplaneHub()
+        server = await hub.start_tcp("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        resyncs = {"a": 0, "b": 0}
+        delivered = []
+
+        async def deliver(session_code, message):
+            delivered.append(message)
+
+        def resync(worker):
+            def run():
+                resyncs[worker] += 1
+            return run
+
+        worker_a, worker_b = RedisBackplane(f"redis://127.0.0.1:{port}"), RedisBackplane(f"redis://127.0.0.1:{port}")
+        await worker_a.start(deliver, resync("a"))
+        await worker_b.start(deliver, resync("b"))
+        assert resyncs == {"a": 1, "b": 1}
+
+        # A publish that fails resyncs this worker, and the others once it gets through
+        worker_a.port = 1
+        worker_a._drop_commands()
+        await worker_a.publish("bp", {"type": "vote_updated", "seq": 1})
+        assert resyncs == {"a": 2, "b": 1}
+        worker_a.port = port
+        await worker_a.publish("bp", {"type": "vote_updated", "seq": 2})
+        await _wait_for(lambda: delivered == [{"type": "vote_updated", "seq": 2}])
+        assert resyncs == {"a": 2, "b": 2}
+
+        # A subscription that comes back may have missed events
+        await hub.stop()
+        hub = BackplaneHub()
+        await hub.start_tcp("127.0.0.1", port)
+        await _wait_for(lambda: resyncs == {"a": 3, "b": 3}, timeout=5)
+
+        await worker_a.stop()
+        await worker_b.stop()
+        await hub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_resp_backplane_times_out_on_a_hung_server():
+    async def hang(reader, writer):
+        await reader.read()
+
+    async def scenario():
+        server = await asyncio.start_server(hang, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backplane = RedisBackplane(f"redis://127.0.0.1:{port}", command_timeout=0.05)
+        results = await asyncio.gather(backplane.next_sequence("bp"), backplane.add_participants("bp", 1))
+        server.close()
+        return results
+
+    # Each command gives up after the timeout instead of holding the lock forever
+    assert asyncio.run(asyncio.wait_for(scenario(), timeout=1)) == [1, 1]
+
+
+def test_create_backplane_from_url():
+    assert type(create_backplane("memory")) is InProcessBackplane
+    assert isinstance(create_backplane("unix:///tmp/aura.sock"), UnixSocketBackplane)
+    redis = create_backplane("redis://:secret@cache:6380/2")
+    assert (redis.host, redis.port, redis.password, redis.db) == ("cache", 6380, "secret", 2)
+    with pytest.raises(ValueError):
+        create_backplane("amqp://broker")
+
+
+def test_incomplete_backplane_fails_on_creation():
+    class NoTransport(RespBackplane):
+        pass
+
+    with pytest.raises(TypeError):
+        NoTransport()
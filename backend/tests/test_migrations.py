@@ -0,0 +1,37 @@
+from sqlalchemy import create_engine, inspect
+
+from app.core.database import Base
+from app.core.migrations import LATEST_VERSION, current_version, migrate
+from app.models.queue import Queue, UserVote
+
+
+def test_migrations_create_the_model_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with engine.begin() as connection:
+        assert migrate(connection) == [1, 2]
+        assert migrate(connection) == []
+        assert current_version(connection) == LATEST_VERSION
+
+    inspector = inspect(engine)
+    assert set(inspector.get_table_names()) >= set(Base.metadata.tables)
+    for table in (Queue.__table__, UserVote.__table__):
+        created = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= created
+
+
+def test_migrations_upgrade_a_pre_migration_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # Databases created before migrations existed have the tables but no version
+    with engine.begin() as connection:
+        migrate(connection, target=1)
+        connection.exec_driver_sql("DROP TABLE schema_version")
+        connection.exec_driver_sql("INSERT INTO sessions (session_code, host_id, manual_sort) VALUES ('OLD1', 'h', 0)")
+
+    with engine.begin() as connection:
+        assert migrate(connection) == [1, 2]
+        assert connection.exec_driver_sql("SELECT session_code FROM sessions").scalar() == "OLD1"
+        plan = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT id FROM queue WHERE session_code = 'OLD1' AND played = 0 ORDER BY votes DESC, id"
+        ).all()
+    assert "ix_queue_session_votes" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.jamendo_client import JamendoClient
+from app.services.upstream import MusicProvider, UpstreamClient
+
+JAMENDO_RESULTS = {
+    "headers": {"status": "success"},
+    "results": [
+        {"id": "1", "name": "Song 1", "artist_name": "Artist 1", "audio": "url1", "image": "img1"},
+        {"id": "2", "name": "No Audio", "artist_name": "Artist 2", "audio": "", "image": "img2"},
+    ],
+}
+
+
+def test_jamendo_client_retries_transient_upstream_errors():
+    requests = []
+
+    def upstream(request: httpx.Request):
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json=JAMENDO_RESULTS)
+
+    async def scenario():
+        client = JamendoClient("test-id", transport=httpx.MockTransport(upstream))
+        client.http.backoff = 0
+        await client.start()
+        tracks, error = await client.search_tracks("daft punk", limit=5)
+        await client.close()
+        return tracks, error
+
+    tracks, error = asyncio.run(scenario())
+    assert error is None
+    assert tracks == [{"id": "1", "name": "Song 1", "artist_name": "Artist 1", "audio": "url1", "image": "img1"}]
+    assert len(requests) == 2
+    assert requests[-1].url.params["namesearch"] == "daft punk"
+    assert requests[-1].url.params["limit"] == "5"
+
+
+def test_jamendo_client_reports_upstream_failures():
+    def upstream(request: httpx.Request):
+        if request.url.params["namesearch"] == "down":
+            raise httpx.ConnectError("connection refused")
+        return httpx.Response(200, json={"headers": {"status": "failed", "error_message": "Invalid client id"}})
+
+    async def scenario():
+        client = JamendoClient("test-id", transport=httpx.MockTransport(upstream))
+        client.http.backoff = 0
+        results = [await client.search_tracks("down"), await client.search_tracks("up")]
+        await client.close()
+        return results
+
+    (down, down_error), (up, up_error) = asyncio.run(scenario())
+    assert down is None and down_error.startswith("Failed to connect to Jamendo API")
+    assert up is None and up_error == "Jamendo API error: Invalid client id"
+
+
+def test_upstream_client_caps_concurrent_requests():
+    in_flight, peak = 0, 0
+
+    async def upstream(request: httpx.Request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, json={"ok": True})
+
+    async def scenario():
+        client = UpstreamClient("http://upstream", transport=httpx.MockTransport(upstream), concurrency=3)
+        results = await asyncio.gather(*(client.get_json("/search") for _ in range(12)))
+        await client.close()
+        return results
+
+    assert asyncio.run(scenario()) == [{"ok": True}] * 12
+    assert peak == 3
+
+
+def test_upstream_client_gives_up_on_long_retry_after():
+    requests = []
+
+    def upstream(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    async def scenario():
+        client = UpstreamClient("http://upstream", transport=httpx.MockTransport(upstream), timeout=5)
+        try:
+            await client.get_json("/search")
+        except httpx.HTTPStatusError as e:
+            return e.response.status_code
+        finally:
+            await client.close()
+
+    # Waiting an hour would outlast the request budget: the 429 is returned at once
+    assert asyncio.run(asyncio.wait_for(scenario(), timeout=1)) == 429
+    assert len(requests) == 1
+
+
+def test_incomplete_provider_fails_on_creation():
+    class NoSearch(MusicProvider):
+        name = "nosearch"
+
+    with pytest.raises(TypeError):
+        NoSearch()